@@ -0,0 +1,271 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+'''Benchmark sitepath against synthetic site-packages directories.
+
+Usage:
+
+    python benchmarks/bench_sitepath.py [options]
+
+Options:
+    --sizes <N,N,..>    site-packages entries to generate (1000,10000)
+    --managed <F>       fraction of entries that sitepath copies (0.02)
+    --shape <S>         origin tree shape: flat, deep or wide (flat)
+    --files <N>         files per origin tree (20)
+    --repeat <N>        runs per measurement, the best is kept (3)
+    --output <file>     write the results as JSON (bench-sitepath.json)
+    --compare <file>    compare with the results of an earlier run
+
+Each measurement drives core.process() with a SitePathTop pointing at
+the generated directories and records the best wall time of plain
+runs. One more run under instrumentation, which is not timed, counts
+the stat/open/scandir calls made from Python and the peak traced
+memory.
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import builtins
+import platform
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import sitepath
+import sitepath.index
+from sitepath import core
+
+
+class Counter:
+    # Count calls of os.stat/os.lstat/os.scandir/open while active.
+
+    targets = [(os, 'stat'), (os, 'lstat'), (os, 'scandir'),
+               (builtins, 'open')]
+
+    def __enter__(self):
+        self.counts = {name: 0 for mod, name in self.targets}
+        self.saved = []
+        for mod, name in self.targets:
+            func = getattr(mod, name)
+            self.saved.append((mod, name, func))
+            setattr(mod, name, self._wrap(name, func))
+        return self
+
+    def _wrap(self, name, func):
+        counts = self.counts
+        def wrapper(*args, **kw):
+            counts[name] += 1
+            return func(*args, **kw)
+        return wrapper
+
+    def __exit__(self, *exc):
+        for mod, name, func in self.saved:
+            setattr(mod, name, func)
+
+
+def make_origin(root, name, shape, nfiles):
+    p = os.path.join(root, name)
+    os.makedirs(p)
+    with open(os.path.join(p, '__init__.py'), 'w') as fp:
+        fp.write('# %s\n' % name)
+
+    for i in range(nfiles):
+        if shape == 'deep':
+            d = os.path.join(p, *['d%i' % j for j in range(i % 8)])
+        elif shape == 'wide':
+            d = os.path.join(p, 'sub%i' % (i % 10))
+        else:
+            d = p
+        os.makedirs(d, exist_ok=True)
+        with open(os.path.join(d, 'm%i.py' % i), 'w') as fp:
+            fp.write('x = %r\n' % ('data' * (i % 50)))
+    return p
+
+
+def make_env(root, size, managed, shape, nfiles):
+    sp = os.path.join(root, 'site-packages')
+    usp = os.path.join(root, 'user-site-packages')
+    origins = os.path.join(root, 'origins')
+    for d in (sp, usp, origins):
+        os.makedirs(d)
+
+    nmanaged = max(1, int(size * managed))
+    for i in range(size - nmanaged):
+        kind = i % 4
+        if kind == 0:
+            os.makedirs(os.path.join(sp, 'pkg%i' % i))
+        elif kind == 1:
+            os.makedirs(os.path.join(sp, 'pkg%i-1.0.dist-info' % i))
+        elif kind == 2:
+            open(os.path.join(sp, 'mod%i.py' % i), 'w').close()
+        else:
+            with open(os.path.join(sp, 'extra%i.pth' % i), 'w') as fp:
+                fp.write('\n')
+
+    paths = [make_origin(origins, 'origin%i' % i, shape, nfiles)
+             for i in range(nmanaged)]
+    reqs = os.path.join(root, 'copies.txt')
+    with open(reqs, 'w') as fp:
+        fp.write('\n'.join(paths))
+
+    top = core.SitePathTop(
+        sp=[sp], usp=usp, syspath=[sp], cwd=root,
+        stdout=io.StringIO(), stderr=io.StringIO(),
+        enable_user_site=False, now='2000-01-01T00:00:00', env={})
+    return top, sp, reqs, paths
+
+
+def measure(func, repeat, setup=None):
+    # `setup` puts things back in place before each run, untimed.
+    best = None
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        t0 = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - t0
+        if best is None or seconds < best:
+            best = seconds
+
+    # tracing slows the run several times over, so it is not timed
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    with Counter() as c:
+        func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    r = {'seconds': best, 'peak_kb': peak // 1024}
+    r.update(c.counts)
+    return r
+
+
+def run(size, managed, shape, nfiles, repeat):
+    root = tempfile.mkdtemp(prefix='bench_sitepath_')
+    try:
+        top, sp, reqs, paths = make_env(root, size, managed, shape, nfiles)
+        do = lambda s: core.process(['sitepath'] + s.split(), top)
+        index = os.path.join(sp, sitepath.index.INDEX)
+
+        def cold_status():
+            # Empty the index in place for one scan, then put it back.
+            # Reading does not write it, and an in-place write leaves
+            # the directory mtime it records alone.
+            with open(index, 'r+') as fp:
+                saved = fp.read()
+                fp.seek(0)
+                fp.truncate()
+            core._get_status(top)
+            with open(index, 'w') as fp:
+                fp.write(saved)
+
+        def touch_origins():
+            for p in paths:
+                os.utime(os.path.join(p, '__init__.py'))
+
+        first = os.path.join(sp, os.path.basename(paths[0]))
+        def copied():
+            if not os.path.exists(first):
+                do('copy -r ' + reqs)
+        def uncopied():
+            if os.path.exists(first):
+                do('uncopy -r ' + reqs)
+
+        cases = [
+            ('copy -r', lambda: do('copy -r ' + reqs), uncopied),
+            ('copy -r (unchanged)', lambda: do('copy -r ' + reqs), copied),
+            ('status (cold)', cold_status, None),
+            ('status (warm)', lambda: core._get_status(top), None),
+            ('default info', lambda: do(''), None),
+            ('list changed', lambda: do('list changed'), None),
+            ('list changed (touched)', lambda: do('list changed'),
+                touch_origins),
+            ('uncopy -r', lambda: do('uncopy -r ' + reqs), copied),
+        ]
+
+        results = []
+        for name, func, setup in cases:
+            top.stdout = io.StringIO()
+            top.stderr = io.StringIO()
+            r = measure(func, repeat, setup)
+            r.update(name=name, size=size, managed=len(paths),
+                     shape=shape, files=nfiles)
+            results.append(r)
+            print('%8i %-24s %8.3fs  stat=%-8i open=%-8i scandir=%-6i %8i KiB' % (
+                size, name, r['seconds'], r['stat'] + r['lstat'], r['open'],
+                r['scandir'], r['peak_kb']))
+        return results
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(old, new):
+    key = lambda r: (r['size'], r['name'])
+    before = {key(r): r for r in old['results']}
+    print()
+    print('%8s %-24s %10s %10s %8s' % ('size', 'case', 'before', 'after',
+                                      'ratio'))
+    for r in new['results']:
+        o = before.get(key(r))
+        if o is None:
+            continue
+        ratio = r['seconds'] / o['seconds'] if o['seconds'] else float('inf')
+        print('%8i %-24s %9.3fs %9.3fs %7.2fx' % (
+            r['size'], r['name'], o['seconds'], r['seconds'], ratio))
+
+
+def main(argv):
+    opts = {'--sizes': '1000,10000', '--managed': '0.02', '--shape': 'flat',
+            '--files': '20', '--repeat': '3',
+            '--output': 'bench-sitepath.json', '--compare': None}
+    args = list(argv)
+    while args:
+        opt = args.pop(0)
+        if opt in ('-h', '--help'):
+            print(__doc__)
+            return
+        if opt not in opts or not args:
+            raise SystemExit('bad option: %r (see --help)' % opt)
+        opts[opt] = args.pop(0)
+
+    results = []
+    for size in opts['--sizes'].split(','):
+        results.extend(run(int(size), float(opts['--managed']),
+                           opts['--shape'], int(opts['--files']),
+                           int(opts['--repeat'])))
+
+    out = {
+        'sitepath': sitepath.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(opts['--output'], 'w') as fp:
+        json.dump(out, fp, indent=2)
+    print('wrote %s' % opts['--output'])
+
+    if opts['--compare']:
+        with open(opts['--compare']) as fp:
+            compare(json.load(fp), out)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
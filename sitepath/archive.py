@@ -0,0 +1,161 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# The zip archives of `sitepath zip`. A package is stored uncompressed
+# below its own name, and a <name>.sitepath-zip.pth file puts the
+# archive on sys.path, so that zipimport finds every module of the
+# package from one open file.
+
+import os
+import stat
+import time
+import hashlib
+import zipfile
+import tempfile
+
+from .common import *
+from .copier import scan_tree, new_manifest, HASH
+
+
+def pth_name(ident):
+    return '%s.sitepath-zip.pth' % ident
+
+
+def _zipinfo(path, arcname):
+    # ZipInfo.from_file(), with the timestamp clamped to what a zip
+    # archive can hold, such as for files dated 1970 by
+    # SOURCE_DATE_EPOCH=0 or a Nix store.
+    st = os.stat(path)
+    date_time = time.localtime(st.st_mtime)[:6]
+    date_time = min(max(date_time, (1980, 1, 1, 0, 0, 0)),
+                    (2107, 12, 31, 23, 59, 59))
+    isdir = stat.S_ISDIR(st.st_mode)
+    info = zipfile.ZipInfo(arcname + '/' if isdir else arcname, date_time)
+    info.external_attr = (st.st_mode & 0xFFFF) << 16
+    if isdir:
+        info.external_attr |= 0x10
+    return info
+
+
+def _pyc(src, dfile, level, info):
+    # Bytecode for `src` that zipimport uses without checking the
+    # source, which cannot change inside the archive. Before Python
+    # 3.7, which has no hash-based .pyc, the bytecode records the time
+    # of the source entry `info`, which is what zipimport compares.
+    import py_compile
+    fd, tmp = tempfile.mkstemp(suffix='.pyc')
+    os.close(fd)
+    try:
+        if hasattr(py_compile, 'PycInvalidationMode'):
+            py_compile.compile(
+                src, cfile=tmp, dfile=dfile, doraise=True, optimize=level,
+                invalidation_mode=
+                    py_compile.PycInvalidationMode.UNCHECKED_HASH)
+            with open(tmp, 'rb') as fp:
+                return fp.read()
+        py_compile.compile(src, cfile=tmp, dfile=dfile, doraise=True,
+                           optimize=level)
+        with open(tmp, 'rb') as fp:
+            data = fp.read()
+        mtime = int(time.mktime(info.date_time + (0, 0, -1)))
+        return data[:4] + (mtime & 0xFFFFFFFF).to_bytes(4, 'little') + \
+            data[8:]
+    finally:
+        os.remove(tmp)
+
+
+def build(origin, dst, rules=None, level=None):
+    # Write `origin` to the archive `dst` through a temporary file. With
+    # `level`, modules also get a .pyc next to their source, which is
+    # where zipimport looks for bytecode. The archive gets the
+    # permissions of `origin`, without the execute bits. Returns the
+    # manifest of the origin files and the number of modules that did
+    # not compile.
+    origin, dst = str(origin), str(dst)
+    name = os.path.basename(origin)
+    if os.path.isdir(origin):
+        dirs, files = scan_tree(origin, rules)
+    else:
+        dirs, files = [], {'': os.stat(origin)}
+
+    failed = 0
+    entries = {}
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dst),
+                               suffix='.sitepath-stage',
+                               dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as zf:
+            if os.path.isdir(origin):
+                zf.writestr(_zipinfo(origin, name), b'')
+            for rel in dirs:
+                zf.writestr(_zipinfo(os.path.join(origin, rel),
+                                     _arcname(name, rel)), b'')
+            for rel, st in sorted(files.items()):
+                src = os.path.join(origin, rel) if rel else origin
+                arcname = _arcname(name, rel) if rel else name
+                with open(src, 'rb') as fp:
+                    data = fp.read()
+                info = _zipinfo(src, arcname)
+                zf.writestr(info, data)
+                # no installed mtime, the file is inside the archive
+                entries[rel] = [st.st_size, st.st_mtime_ns,
+                                hashlib.new(HASH, data).hexdigest(), None]
+
+                if level is not None and arcname.endswith('.py'):
+                    try:
+                        pyc = _pyc(src, os.path.join(dst, arcname), level,
+                                   info)
+                    except Exception:   # py_compile.PyCompileError
+                        failed += 1
+                        continue
+                    zf.writestr(_zipinfo(src, arcname[:-3] + '.pyc'), pyc)
+        # mkstemp files are private
+        os.chmod(tmp, stat.S_IMODE(os.stat(origin).st_mode) & 0o666)
+        os.replace(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return new_manifest(entries), failed
+
+
+def _arcname(name, rel):
+    return '/'.join([name] + rel.split(os.sep))
+
+
+def changed(dst, origin, rules=None):
+    # Whether the files of `origin` differ from the archive, byte by
+    # byte. Bytecode written by build() is not compared.
+    origin, dst = str(origin), str(dst)
+    name = os.path.basename(origin)
+    if os.path.isdir(origin):
+        _, files = scan_tree(origin, rules)
+        names = {_arcname(name, rel): rel for rel in files}
+    else:
+        names = {name: ''}
+
+    with zipfile.ZipFile(dst) as zf:
+        members = {i.filename for i in zf.infolist() if not i.is_dir()}
+        pycs = {n[:-3] + '.pyc' for n in names if n.endswith('.py')}
+        if set(names) != members - (pycs - set(names)):
+            return True
+        for arcname, rel in names.items():
+            src = os.path.join(origin, rel) if rel else origin
+            with open(src, 'rb') as fp:
+                if fp.read() != zf.read(arcname):
+                    return True
+    return False
@@ -0,0 +1,101 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# Precompile installed packages for --compile, and find bytecode that
+# no longer matches its source for `list changed`.
+
+import os
+import sys
+import compileall
+import importlib.util
+
+from .common import *
+
+LEVELS = (0, 1, 2)
+
+
+def parse_levels(s):
+    # '0,1,2' -> [0, 1, 2]
+    try:
+        levels = sorted({int(x) for x in s.split(',') if x.strip()})
+    except ValueError:
+        levels = None
+    if not levels or not set(levels) <= set(LEVELS):
+        raise SitePathException(
+            'Expecting --optimize levels from 0, 1, 2, got %r' % s)
+    return levels
+
+
+def compile_path(p, levels, jobs=1):
+    # Write the .pyc files of `p` for each optimization level, with a
+    # process pool when jobs > 1. Returns False if any file failed.
+    p = str(p)
+    if os.path.isdir(p):
+        workers = jobs if jobs > 1 else 1
+        if sys.version_info >= (3, 9):
+            return bool(compileall.compile_dir(
+                p, quiet=2, optimize=levels, workers=workers))
+        return all([compileall.compile_dir(
+                        p, quiet=2, optimize=level, workers=workers)
+                    for level in levels])
+    if not p.endswith('.py'):
+        return True
+    return all([compileall.compile_file(p, quiet=2, optimize=level)
+                for level in levels])
+
+
+def _pyc(source, level):
+    return importlib.util.cache_from_source(
+        source, optimization=level if level else '')
+
+
+def fresh(source, pyc):
+    # Whether `pyc` would be used for `source` without recompiling.
+    try:
+        with open(pyc, 'rb') as fp:
+            head = fp.read(16)
+        st = os.stat(source)
+    except OSError:
+        return False
+    if len(head) < 16 or head[:4] != importlib.util.MAGIC_NUMBER:
+        return False
+    if int.from_bytes(head[4:8], 'little') & 1:
+        # hash-based, see PEP 552
+        with open(source, 'rb') as fp:
+            return head[8:16] == importlib.util.source_hash(fp.read())
+    mtime = int.from_bytes(head[8:12], 'little')
+    size = int.from_bytes(head[12:16], 'little')
+    return (mtime == int(st.st_mtime) & 0xFFFFFFFF
+            and size == st.st_size & 0xFFFFFFFF)
+
+
+def _sources(p):
+    if os.path.isfile(p):
+        if p.endswith('.py'):
+            yield p
+        return
+    for head, dirs, files in os.walk(p):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for f in sorted(files):
+            if f.endswith('.py'):
+                yield os.path.join(head, f)
+
+
+def stale(p, levels):
+    # Source files under `p` without fresh bytecode for every level.
+    return [source for source in _sources(str(p))
+            if not all(fresh(source, _pyc(source, level))
+                       for level in levels)]
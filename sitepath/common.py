@@ -15,6 +15,7 @@
 ##
 
 import os
+import time
 
 def fprint(file, *args, **kw):
     print(*args, file=file, **kw)
@@ -38,6 +39,96 @@ class result:
         return cls(u)
 
 
+class Emitter:
+    # Machine-readable output. 'ndjson' writes each record as soon as it
+    # is emitted, 'json' writes a single list of them on close().
+
+    formats = ('text', 'json', 'ndjson')
+
+    def __init__(self, file, fmt):
+        self.file = file
+        self.fmt = fmt
+        self.records = []
+
+    def emit(self, rec):
+        import json
+        if self.fmt == 'ndjson':
+            fprint(self.file, json.dumps(rec, sort_keys=True))
+        else:
+            self.records.append(rec)
+
+    def close(self):
+        import json
+        if self.fmt == 'json':
+            fprint(self.file, json.dumps(self.records, indent=2,
+                                         sort_keys=True))
+            self.records = []
+
+
+class phase:
+    # Tell an observer when a unit of work starts and ends:
+    #
+    #   observer.start(name, item)
+    #   observer.end(name, item, seconds)
+    #
+    # With no observer this does nothing.
+
+    def __init__(self, observer, name, item=None):
+        self.observer = observer
+        self.name = name
+        self.item = item
+
+    def __enter__(self):
+        if self.observer is not None:
+            self.observer.start(self.name, self.item)
+            self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.observer is not None:
+            seconds = time.perf_counter() - self.t0
+            self.observer.end(self.name, self.item, seconds)
+
+
+class Timings:
+    # An observer that collects per-phase and per-item times for
+    # --timings, passing the events on to another observer if given.
+
+    def __init__(self, chained=None):
+        import threading
+        self.chained = chained
+        self.lock = threading.Lock()
+        self.phases = {}    # name -> [count, total, longest]
+        self.items = []     # (seconds, name, item)
+
+    def start(self, name, item):
+        if self.chained is not None:
+            self.chained.start(name, item)
+
+    def end(self, name, item, seconds):
+        with self.lock:
+            p = self.phases.setdefault(name, [0, 0.0, 0.0])
+            p[0] += 1
+            p[1] += seconds
+            p[2] = max(p[2], seconds)
+            if item is not None:
+                self.items.append((seconds, name, item))
+        if self.chained is not None:
+            self.chained.end(name, item, seconds)
+
+    def report(self, file, limit=20):
+        fprint(file, '# timings: phase, count, total, longest')
+        for name, (count, total, longest) in sorted(
+                self.phases.items(), key=lambda kv: -kv[1][1]):
+            fprint(file, '#   %-12s %6i %10.3fs %10.3fs' % (
+                name, count, total, longest))
+        if self.items:
+            fprint(file, '# timings: slowest items')
+            for seconds, name, item in sorted(self.items,
+                                              reverse=True)[:limit]:
+                fprint(file, '#   %10.3fs  %-12s %s' % (seconds, name, item))
+
+
 class SitePathException(ValueError):
     pass
 
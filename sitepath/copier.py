@@ -0,0 +1,527 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+import os
+import errno
+import shutil
+import time
+import hashlib
+import tempfile
+import threading
+
+from .common import *
+
+
+def scan_tree(root, rules=None):
+    # Walk `root` once, returning relative directories (parents first)
+    # and a {relative file: stat} mapping. Symlinks are followed,
+    # matching the behavior of shutil.copytree. Entries matching the
+    # IgnoreRules `rules` are skipped, directories with their contents.
+    dirs = []
+    files = {}
+    todo = ['']
+    while todo:
+        rel = todo.pop()
+        with os.scandir(os.path.join(root, rel)) as it:
+            for entry in it:
+                r = os.path.join(rel, entry.name)
+                if rules is not None and rules(r, entry.is_dir()):
+                    continue
+                if entry.is_dir():
+                    dirs.append(r)
+                    todo.append(r)
+                else:
+                    files[r] = entry.stat()
+    dirs.sort()
+    return dirs, files
+
+
+def same_stat(a, b):
+    # copy2 preserves mtime, so size + mtime is a reliable quick check
+    return a.st_size == b.st_size and a.st_mtime_ns == b.st_mtime_ns
+
+
+def _remove(p):
+    if os.path.isdir(p) and not os.path.islink(p):
+        shutil.rmtree(p)
+    else:
+        os.remove(p)
+
+
+HASH = 'sha256'
+CHUNK = 1024 * 1024
+
+
+def hash_file(p):
+    h = hashlib.new(HASH)
+    with open(p, 'rb') as fp:
+        while True:
+            buf = fp.read(CHUNK)
+            if not buf:
+                break
+            h.update(buf)
+    return h.hexdigest()
+
+
+def copy_hashed(src, dst):
+    # Like shutil.copy2, but hashes the content in the same read pass.
+    h = hashlib.new(HASH)
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        while True:
+            buf = fsrc.read(CHUNK)
+            if not buf:
+                break
+            h.update(buf)
+            fdst.write(buf)
+    shutil.copystat(src, dst)
+    return h.hexdigest()
+
+
+class OriginCache:
+    # Origin scans and file hashes shared by the copies of one batch,
+    # such as the same origin copied into several environments at once.
+    # Each scan or hash is computed by one thread while the others wait
+    # for it. Scans are not revalidated, so use one cache per batch.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.scans = {}     # (origin, patterns) -> [lock, (dirs, files)]
+        self.digests = {}   # (path, size, mtime_ns) -> [lock, digest]
+
+    def _get(self, table, key, func):
+        with self.lock:
+            slot = table.setdefault(key, [threading.Lock(), None])
+        with slot[0]:
+            if slot[1] is None:
+                slot[1] = func()
+            return slot[1]
+
+    def scan(self, origin, rules=None):
+        key = (origin, None if rules is None else tuple(rules.patterns))
+        return self._get(self.scans, key, lambda: scan_tree(origin, rules))
+
+    def digest(self, path, st):
+        key = (path, st.st_size, st.st_mtime_ns)
+        return self._get(self.digests, key, lambda: hash_file(path))
+
+    def remember(self, path, st, digest):
+        # a digest computed while copying, for the copies still to come
+        key = (path, st.st_size, st.st_mtime_ns)
+        with self.lock:
+            slot = self.digests.setdefault(key, [threading.Lock(), None])
+            if slot[1] is None:
+                slot[1] = digest
+
+
+
+def manifest_entry(st, digest, dst_st):
+    # [size, mtime_ns, digest, installed mtime_ns]
+    return [st.st_size, st.st_mtime_ns, digest, dst_st.st_mtime_ns]
+
+
+def _known_digest(old, rel, st):
+    # reuse a digest from a previous manifest when the origin is unchanged
+    if old is None or old.get('hash') != HASH:
+        return None
+    e = old['files'].get(rel)
+    if e is None or e[0] != st.st_size or e[1] != st.st_mtime_ns:
+        return None
+    return e[2]
+
+
+# errors that mean a copy method does not work here at all
+_UNSUPPORTED = {getattr(errno, e) for e in (
+    'EXDEV', 'EOPNOTSUPP', 'ENOTSUP', 'EINVAL', 'ENOSYS', 'ENOTTY',
+    'EPERM', 'EBADF', 'EMLINK') if hasattr(errno, e)}
+
+FICLONE = 0x40049409   # linux/fs.h
+
+
+class Backend:
+    # Copies files with the requested method, falling back per file.
+    # Methods that turn out to be unsupported are not retried.
+
+    names = ('auto', 'reflink', 'hardlink', 'kernel', 'python')
+
+    fallbacks = {
+        # python hashes the file as it copies it, the kernel does not
+        'auto': ('reflink', 'python'),
+        'reflink': ('reflink', 'python'),
+        'hardlink': ('hardlink', 'python'),
+        'kernel': ('kernel', 'python'),
+        'python': ('python',),
+    }
+
+    def __init__(self, name='auto'):
+        if name not in self.names:
+            raise SitePathException('Backend not recognized: %r' % name)
+        self.name = name
+        self.broken = set()
+        self.used = set()
+
+    def describe(self):
+        # the methods used, as recorded in the crumb
+        return '+'.join(sorted(self.used)) or self.name
+
+    def copy(self, src, dst, digest=None):
+        # Copy `src` to `dst`, returning the content hash. A known
+        # `digest` of `src`, or a function that returns it, saves
+        # reading it back. The function is only called when the content
+        # did not pass through here.
+        for method in self.fallbacks[self.name]:
+            if method in self.broken:
+                continue
+            if method == 'python':
+                digest = copy_hashed(src, dst)
+            else:
+                try:
+                    getattr(self, '_' + method)(src, dst)
+                except (OSError, AttributeError, ImportError) as err:
+                    # no fcntl (Windows) or os.sendfile, or a refusal
+                    if not isinstance(err, OSError) or \
+                            err.errno in _UNSUPPORTED:
+                        self.broken.add(method)
+                    continue
+                # the content did not pass through here, read it back
+                if digest is None:
+                    digest = hash_file(src)
+                elif callable(digest):
+                    digest = digest()
+            self.used.add(method)
+            return digest
+
+    def _reflink(self, src, dst):
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+
+    def _hardlink(self, src, dst):
+        if os.path.lexists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+
+    def _kernel(self, src, dst):
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            infd, outfd = fsrc.fileno(), fdst.fileno()
+            if hasattr(os, 'copy_file_range'):
+                send = lambda n: os.copy_file_range(infd, outfd, n)
+            else:
+                send = lambda n: os.sendfile(outfd, infd, None, n)
+            while size > 0:
+                n = send(min(size, 1 << 30))
+                if n == 0:
+                    break
+                size -= n
+        shutil.copystat(src, dst)
+
+
+def _do_copy(src, dst, st, backend, cache=None):
+    # With a cache, each origin file is hashed once for all its copies:
+    # by the first copy that reads it, or on demand by the others.
+    if cache is None:
+        return manifest_entry(st, backend.copy(src, dst), os.stat(dst))
+    digest = backend.copy(src, dst, lambda: cache.digest(src, st))
+    cache.remember(src, st, digest)
+    return manifest_entry(st, digest, os.stat(dst))
+
+
+def run_tasks(tasks, jobs=1):
+    # Run (func, args) tasks, using a thread pool when jobs > 1.
+    # Returns the results in task order.
+    if jobs <= 1 or len(tasks) <= 1:
+        return [func(*args) for func, args in tasks]
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(func, *args) for func, args in tasks]
+    # the pool has drained, report the first error if any
+    return [f.result() for f in futures]
+
+
+def new_manifest(files):
+    return {'hash': HASH, 'files': files}
+
+
+TRASH = '.sitepath-trash'
+STALE = 60      # s, after which the trash of another run is a leftover
+
+_trash_lock = threading.Lock()
+_aside = set()  # trees in the trash that this process still handles
+
+
+def _stage_name(dst, suffix):
+    head, tail = os.path.split(dst)
+    return tempfile.mkdtemp(prefix='.%s.' % tail, suffix=suffix, dir=head)
+
+
+def _set_aside(dst):
+    # Move `dst` into the trash directory in one rename, returning the
+    # directory that now holds it. The trash directory keeps the later
+    # deletion from touching the mtime of site-packages itself.
+    head, tail = os.path.split(dst)
+    trash = os.path.join(head, TRASH)
+    os.makedirs(trash, exist_ok=True)
+    old = tempfile.mkdtemp(prefix=tail + '.', dir=trash)
+    with _trash_lock:
+        _aside.add(old)
+    try:
+        os.rename(dst, os.path.join(old, tail))
+    except BaseException:
+        os.rmdir(old)
+        with _trash_lock:
+            _aside.discard(old)
+        raise
+    return old
+
+
+def _leftovers(trash):
+    # The trees that an interrupted run left in `trash`. Those of
+    # another run that may still be swapping are younger than STALE.
+    limit = time.time() - STALE
+    try:
+        names = os.listdir(trash)
+    except OSError:
+        return []
+    found = []
+    with _trash_lock:
+        for name in names:
+            p = os.path.join(trash, name)
+            try:
+                if p in _aside or os.lstat(p).st_mtime > limit:
+                    continue
+            except OSError:
+                continue
+            _aside.add(p)
+            found.append(p)
+    return found
+
+
+def _discard(trees):
+    for p in trees:
+        shutil.rmtree(p, ignore_errors=True)
+        with _trash_lock:
+            _aside.discard(p)
+
+
+def _swap(stage, dst):
+    # Replace `dst` with `stage`. Only the two renames separate the old
+    # tree from the new. If the second one fails, the old tree is put
+    # back, and it is only deleted, in the background, once the new
+    # tree is in place, along with the leftovers of interrupted runs.
+    # The trash directory itself stays, as removing it would change
+    # the mtime of site-packages that its index records.
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        old = _set_aside(dst)
+        try:
+            os.rename(stage, dst)
+        except BaseException:
+            os.rename(os.path.join(old, os.path.basename(dst)), dst)
+            os.rmdir(old)
+            with _trash_lock:
+                _aside.discard(old)
+            raise
+        trees = [old] + _leftovers(os.path.dirname(old))
+        t = threading.Thread(target=_discard, args=(trees,))
+        t.start()
+    else:
+        os.replace(stage, dst)
+
+
+def _do_link(dst_file, stage_file, src, st, dst_st, backend, digest=None,
+             cache=None):
+    # reuse an unchanged installed file, falling back to a copy
+    try:
+        os.link(dst_file, stage_file)
+    except OSError:
+        return _do_copy(src, stage_file, st, backend, cache)
+    if digest is None:
+        digest = cache.digest(src, st) if cache else hash_file(src)
+    return manifest_entry(st, digest, dst_st)
+
+
+def sync_file(origin, dst, manifest=None, backend=None, reuse=True,
+              cache=None):
+    origin, dst = str(origin), str(dst)
+    if backend is None:
+        backend = Backend()
+    st = os.stat(origin)
+    if reuse and os.path.lexists(dst):
+        if os.path.isfile(dst) and not os.path.islink(dst):
+            dst_st = os.stat(dst)
+            if same_stat(st, dst_st):
+                digest = _known_digest(manifest, '', st)
+                if digest is None:
+                    digest = (cache.digest(origin, st) if cache
+                              else hash_file(origin))
+                return result(copied=0, removed=0, unchanged=1,
+                    backend=backend, manifest=new_manifest(
+                        {'': manifest_entry(st, digest, dst_st)}))
+
+    # copy next to `dst`, then rename over it
+    fd, tmp = tempfile.mkstemp(prefix='.%s.' % os.path.basename(dst),
+                               suffix='.sitepath-stage',
+                               dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        entry = _do_copy(origin, tmp, st, backend, cache)
+        _swap(tmp, dst)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    entry[3] = os.stat(dst).st_mtime_ns
+    return result(copied=1, removed=0, unchanged=0,
+                  backend=backend, manifest=new_manifest({'': entry}))
+
+
+def sync_tree(origin, dst, jobs=1, manifest=None, backend=None, reuse=True,
+              cache=None, rules=None, bytecode=False):
+    # Build the new `dst` from `origin` in a staging directory next to
+    # it and swap it in. Files unchanged since the last copy are
+    # hardlinked from the current `dst` instead of copied again,
+    # unless `reuse` is false, and so is their __pycache__ bytecode
+    # with `bytecode`. An OriginCache shares the origin scan and hashes
+    # with other copies of the same origin. Origin files matching
+    # `rules` are left out. Directories get the permissions of their
+    # origin, as with shutil.copytree.
+    # Returns the counts and a manifest of the resulting tree.
+    origin, dst = str(origin), str(dst)
+    if backend is None:
+        backend = Backend()
+
+    if cache is not None:
+        src_dirs, src_files = cache.scan(origin, rules)
+    else:
+        src_dirs, src_files = scan_tree(origin, rules)
+
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        dst_dirs, dst_files = scan_tree(dst)
+    else:
+        dst_dirs, dst_files = [], {}
+
+    removed = len(set(dst_files).difference(src_files))
+
+    stage = _stage_name(dst, '.sitepath-stage')
+    try:
+        for rel in src_dirs:
+            os.makedirs(os.path.join(stage, rel))
+
+        names = []
+        tasks = []
+        copied = 0
+        unchanged = 0
+        kept = set()
+        for rel, st in sorted(src_files.items()):
+            src = os.path.join(origin, rel)
+            d = dst_files.get(rel)
+            names.append(rel)
+            if reuse and d is not None and same_stat(st, d):
+                unchanged += 1
+                kept.add(rel)
+                digest = _known_digest(manifest, rel, st)
+                tasks.append((_do_link, (os.path.join(dst, rel),
+                    os.path.join(stage, rel), src, st, d, backend, digest,
+                    cache)))
+                continue
+            copied += 1
+            tasks.append((_do_copy,
+                          (src, os.path.join(stage, rel), st, backend, cache)))
+
+        entries = dict(zip(names, run_tasks(tasks, jobs)))
+        if bytecode:
+            removed -= _keep_bytecode(dst, stage, dst_files, kept)
+        # last, as the origin may be read-only, deepest first
+        for rel in sorted(src_dirs, reverse=True):
+            shutil.copystat(os.path.join(origin, rel),
+                            os.path.join(stage, rel))
+        shutil.copystat(origin, stage)
+        _swap(stage, dst)
+    except BaseException:
+        shutil.rmtree(stage, ignore_errors=True)
+        raise
+
+    manifest = new_manifest(entries)
+
+    return result._using('copied, removed, unchanged, manifest, backend',
+                         locals())
+
+
+def _keep_bytecode(dst, stage, dst_files, kept):
+    # Hardlink the __pycache__ files of the `kept` sources of `dst`
+    # into `stage`, where compileall finds them up to date. Returns the
+    # number of files kept.
+    n = 0
+    for rel in dst_files:
+        cache_dir, name = os.path.split(rel)
+        head, tail = os.path.split(cache_dir)
+        if tail != '__pycache__' or not name.endswith('.pyc'):
+            continue
+        source = os.path.join(head, name.split('.', 1)[0] + '.py')
+        if source not in kept:
+            continue
+        try:
+            os.makedirs(os.path.join(stage, cache_dir), exist_ok=True)
+            os.link(os.path.join(dst, rel), os.path.join(stage, rel))
+        except OSError:
+            continue    # compiled again
+        n += 1
+    return n
+
+
+def manifest_diff(origin, dst, manifest, rules=None):
+    # Relative paths that differ between `origin` and the manifest.
+    # Origin files are only hashed when their size/mtime moved. The
+    # installed copy at `dst` is checked by stat alone, never read, and
+    # not at all when `dst` is None. Files matching `rules` are not
+    # compared, in the origin or the manifest.
+    origin = str(origin)
+    dst = None if dst is None else str(dst)
+    files = manifest['files']
+    if rules is not None:
+        files = {rel: e for rel, e in files.items()
+                 if not rules.excludes(rel)}
+
+    if os.path.isdir(origin):
+        _, src_files = scan_tree(origin, rules)
+    else:
+        src_files = {'': os.stat(origin)}
+
+    diff = set(files).symmetric_difference(src_files)
+
+    for rel, st in src_files.items():
+        e = files.get(rel)
+        if e is None:
+            continue
+        if e[0] != st.st_size:
+            diff.add(rel)
+        elif e[1] != st.st_mtime_ns:
+            src = os.path.join(origin, rel) if rel else origin
+            if manifest.get('hash') != HASH or hash_file(src) != e[2]:
+                diff.add(rel)
+
+    for rel, e in files.items() if dst is not None else ():
+        p = os.path.join(dst, rel) if rel else dst
+        try:
+            st = os.stat(p)
+        except OSError:
+            diff.add(rel)
+            continue
+        if st.st_size != e[0] or st.st_mtime_ns != e[3]:
+            diff.add(rel)
+
+    return sorted(diff)
@@ -18,15 +18,11 @@ import site
 import sys
 import os
 import io
-import pathlib
-from pprint import pprint
-import shutil
-import datetime
-import json
+import time
 
+# Only what `help` and `mvp` need is imported here, the commands
+# import the rest when they run. See COMMANDS.
 from ._version import __version__
-from . import ops
-from .crumb import *
 from .common import *
 
 
@@ -37,6 +33,16 @@ class SystemDefault:
 system = SystemDefault()
 
 
+def _isonow():
+    # datetime.datetime.now().isoformat(), without importing datetime
+    t = time.time()
+    us = int(t % 1 * 10**6)
+    now = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(t))
+    if us:
+        now += '.%06d' % us
+    return now
+
+
 class SitePathTop:
     def __init__(self,
                  sp=system,
@@ -47,7 +53,9 @@ class SitePathTop:
                  stderr=system,
                  enable_user_site=system,
                  now=system,
-                 env=system):
+                 env=system,
+                 observer=None,
+                 stdin=system):
 
         if cwd is system:
             cwd = os.getcwd()
@@ -70,8 +78,11 @@ class SitePathTop:
         if stderr is system:
             stderr = sys.stderr
 
+        if stdin is system:
+            stdin = sys.stdin
+
         if now is system:
-            now = datetime.datetime.now().isoformat()
+            now = _isonow()
 
         if env is system:
             env = dict(os.environ)
@@ -100,12 +111,17 @@ class SitePathTop:
                 sites.append(v)
         return sites
 
+    def phase(self, name, item=None):
+        # report a unit of work to the observer, see common.phase
+        return phase(self.observer, name, item)
+
     def abspath(self, p):
         p = os.path.expanduser(p)
         p = os.path.expandvars(p)
         p = os.path.join(self.cwd, p)
         p = os.path.abspath(p)
-        return pathlib.Path(p)
+        from pathlib import Path
+        return Path(p)
 
 
 def show_help(top):
@@ -124,6 +140,24 @@ Commands:
     uncopy          Delete the package name from site-packages.
     develop         Add the parent of the dir/file to [package].sitepath.pth.
     undevelop       Remove [package].sitepath.pth.
+    zip             Store a given directory/file in [package].zip in
+                    site-packages, imported from there through
+                    [package].sitepath-zip.pth.
+    unzip           Remove the zip archive of the package name.
+
+    watch           Copy packages again when their origin changes.
+                    Runs until interrupted.
+
+    startup-cost    Measure what the sitepath .pth files, symlinks and
+                    copies add to interpreter startup and import time.
+
+    sync <file>     Converge site-packages to the "<mode> <path>" lines of
+                    <file>, mode being symlink, copy, develop or zip. Only
+                    what differs is added, re-copied or removed.
+
+    registry        'init' keeps the status of each site-packages directory in
+                    a SQLite registry, 'drop' removes it again. 'query' finds
+                    packages by --name, --origin or --kind.
 
     info            Given detailed information about packages and crumbs.
     list            List by given package type (symlinks, copies, develops).
@@ -135,10 +169,78 @@ Commands:
     -h, --help      Show this help message
 
 General Options:
-    -r <file>       Batch process directory/file lines in given <file>.
+    --timings       Print the time spent per phase and per item to stderr.
+    --format <F>    Output of info, list and the default status:
+                    text (default), json, or ndjson (one record per line).
+    -r <file>       Batch process directory/file lines in given <file>,
+                    or from stdin with `-r -`. Lines from stdin are read
+                    as the batch goes.
+    -j <N>          Process N items at the same time. Items for the same
+                    package name still run one after another, and
+                    copies start with the largest origin.
+    --progress      With `-r -`, report the items done to stderr about
+                    once a second.
     -n              Translate directory/file to its package name
     -nr <file>      Treat directory/file names as package names
                     Useful for unlink/uncopy/undevelop
+    --env <E>       Apply the command to the site-packages of the virtual
+                    environment or interpreter <E> instead. Repeat it to
+                    run in several environments at once.
+    --envs-from <file>
+                    Add the environments listed in <file>, one per line.
+
+Copy Options:
+    --jobs <N>      Copy the files of each package with N threads, and
+                    compile with N processes.
+    --compile       Precompile the package after copy, symlink or develop,
+                    or into the archive of zip.
+    --optimize <L>  Optimization levels to compile, e.g. 0,1,2 (0).
+                    Implies --compile. A zip archive holds the lowest.
+    --exclude <P>   Leave files and directories matching <P> out of the
+                    copy, e.g. 'tests/' or '*.csv'. Repeatable. Also read
+                    from .sitepathignore in the origin. .git, __pycache__,
+                    .tox, node_modules and similar are always left out.
+    --backend <B>   How files are copied, falling back per file:
+                      auto      reflink if possible, else python (default)
+                      reflink   copy-on-write clone (btrfs, XFS)
+                      hardlink  share the origin's files (same filesystem)
+                      kernel    os.copy_file_range/sendfile
+                      python    read and write in Python
+
+Develop Options:
+    --shared-pth    Keep the package in one sitepath.pth file, shared with
+                    other packages developed this way, instead of its own
+                    [package].sitepath.pth. Their directories are listed
+                    once. Packages already in sitepath.pth stay there.
+    --finder        Find the package with an import finder that maps its
+                    name to its path, leaving sys.path unchanged. All
+                    packages developed this way share sitepath-finder.pth.
+
+Watch Options (with the copy options):
+    --interval <S>  Seconds between polls while origins change (1).
+    --max-interval <S>
+                    Longest wait between polls when idle (30).
+    --settle <S>    Seconds an origin must stay unchanged before copying (1).
+    --cycles <N>    Stop after N polls.
+
+Startup-cost Options:
+    --env <E>       Measure this virtual environment or interpreter
+                    instead of the current one.
+    --repeat <N>    Runs per measurement, the best is kept (5).
+
+Sync Options (with the copy and develop options):
+    --plan          Show what sync would do, with the bytes each copy
+                    would write, and change nothing.
+
+List Options:
+    --deep          With 'changed', compare the copied files byte by byte
+                    with their origin instead of using the copy manifest,
+                    which only reads the origin.
+                    'changed' also reports stale bytecode of packages
+                    installed with --compile.
+    -j <N>          With 'changed', compare N packages at a time.
+    --unordered     With 'changed' and -j, print each package as its
+                    comparison finishes instead of in package order.
 
 Examples:
 
@@ -151,15 +253,101 @@ Examples:
     python -m sitepath uncopy -r copies.txt
     python -m sitepath copy -r copies.txt
 
+    # Switch to another set of packages, touching only what differs
+    python -m sitepath sync --plan packages.txt
+    python -m sitepath sync packages.txt
+
 '''.format(version=__version__))
 
 
 
+def _pop_options(arg, valued=(), switches=()):
+    # Remove `--option value` and `--switch` items from anywhere in `arg`.
+    # Valued options may repeat, so their values are collected in lists.
+    found = {}
+    rest = []
+    it = iter(arg)
+    for item in it:
+        if item in valued:
+            value = next(it, None)
+            if value is None:
+                raise SitePathException('Expecting a value for %s' % item)
+            found.setdefault(item, []).append(value)
+        elif item in switches:
+            found[item] = True
+        else:
+            rest.append(item)
+    arg[:] = rest
+    return found
+
+
+def _int_option(opts, name, default):
+    values = opts.get(name)
+    if not values:
+        return default
+    value = values[-1]
+    try:
+        n = int(value)
+    except ValueError:
+        n = 0
+    if n < 1:
+        raise SitePathException(
+            'Expecting a positive integer for %s, got %r' % (name, value))
+    return n
+
+
+def _float_option(opts, name, default):
+    values = opts.get(name)
+    if not values:
+        return default
+    value = values[-1]
+    try:
+        x = float(value)
+    except ValueError:
+        x = -1.0
+    if x < 0:
+        raise SitePathException(
+            'Expecting a non-negative number for %s, got %r' % (name, value))
+    return x
+
+
 def _proc_args(top, arg, un):
     # helper for core functionality
 
-    if len(arg) == 0:
-        return [None]
+    opts = _pop_options(arg, valued=('--jobs', '-j', '--backend', '--env',
+                                     '--envs-from', '--optimize', '--exclude'),
+                        switches=('--compile', '--shared-pth', '--finder',
+                                  '--progress'))
+    jobs = _int_option(opts, '--jobs', 1)   # worker threads per item
+    workers = _int_option(opts, '-j', 1)    # items run at the same time
+    cache = None                            # see copier.OriginCache
+    exclude = opts.get('--exclude', [])     # see ignore.copy_patterns
+    snapshot = None                         # see index.Snapshot
+    progress = opts.get('--progress', False)
+
+    shared_pth = opts.get('--shared-pth', False)
+    finder = opts.get('--finder', False)
+    if shared_pth and finder:
+        raise SitePathException('Use either --shared-pth or --finder')
+
+    levels = None       # bytecode optimization levels for --compile
+    if opts.get('--compile') or '--optimize' in opts:
+        from .bytecode import parse_levels
+        levels = parse_levels(opts.get('--optimize', ['0'])[-1])
+
+    envs = opts.get('--env', [])
+    for file in opts.get('--envs-from', []):
+        from .envs import read_envs
+        envs.extend(read_envs(top, file))
+
+    backend = opts.get('--backend', ['auto'])[-1]
+    if backend != 'auto':
+        from .copier import Backend
+        if backend not in Backend.names:
+            raise SitePathException('Expecting --backend to be one of: %s' % (
+                ', '.join(Backend.names)))
+
+    arg.extend([None, None])   # keep the padding from process()
 
     path_to_name = False
     skip_errors = False
@@ -176,20 +364,20 @@ def _proc_args(top, arg, un):
         if arg[1] is None:
             raise SitePathException("Expecting a file.")
 
-        file = top.abspath(arg[1])
+        if arg[1] == '-':
+            todo = _Lines(top.stdin)
+        else:
+            file = top.abspath(arg[1])
 
-        if not os.path.exists(file):
-            raise SitePathException("File not found %r" % file)
+            if not os.path.exists(file):
+                raise SitePathException("File not found %r" % file)
 
-        with open(file, 'r') as fp:
-            lines = fp.readlines()
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            if line[0] == '#':
-                continue
-            todo.append(line)
+            if workers <= 1:
+                todo = _Lines(path=str(file))
+            else:
+                # read whole, so that -j can start with the largest copies
+                with open(str(file), 'r') as fp:
+                    todo = list(_Lines(fp))
     else:
         while arg:
             item = arg.pop(0)
@@ -205,7 +393,215 @@ def _proc_args(top, arg, un):
             fprint(top.stderr,
                    'note: using -n or -nr has an effect with un-commands only.')
 
-    return result._using('items=todo, skip_errors, path_to_name', locals())
+    return result._using(
+        'items=todo, skip_errors, path_to_name, jobs, workers, backend, '
+        'envs, cache, snapshot, compile=levels, shared_pth, finder, '
+        'exclude, progress', locals())
+
+
+class _Lines:
+    # The items of the lines of an open file, or of the file at `path`
+    # while it is iterated, read one line at a time, so that `-r -`
+    # runs as stdin arrives. `count` is the number of items so far.
+
+    def __init__(self, fp=None, path=None):
+        self.fp = fp
+        self.path = path
+        self.count = 0
+
+    def __iter__(self):
+        if self.path is None:
+            return self._items(self.fp)
+        return self._read()
+
+    def _read(self):
+        with open(self.path, 'r') as fp:
+            for line in self._items(fp):
+                yield line
+
+    def _items(self, fp):
+        for line in fp:
+            line = line.strip()
+            if not line:
+                continue
+            if line[0] == '#':
+                continue
+            self.count += 1
+            yield line
+
+
+def _count(items):
+    return items.count if isinstance(items, _Lines) else len(items)
+
+
+class _Progress:
+    # Progress of a streamed batch on stderr with --progress, at most
+    # once per interval.
+
+    interval = 1.0
+
+    def __init__(self, top, cmd, shown=True):
+        self.top = top
+        self.cmd = cmd
+        self.shown = shown
+        self.done = 0
+        self.failed = 0
+        self.last = time.monotonic()
+
+    def tick(self, err):
+        self.done += 1
+        self.failed += err is not None
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        if self.shown:
+            fprint(self.top.stderr, '# %s: %i item(s) done, %i failed' % (
+                self.cmd, self.done, self.failed))
+
+
+def _run_item(top, cmd, what, flags):
+    from . import ops
+    try:
+        func = getattr(ops, cmd)
+        with top.phase(cmd, what):
+            func(top, what, flags)
+    except (SitePathException, SitePathFailure) as err:
+        return err
+    return None
+
+
+def _dest_name(what):
+    # the site-packages entry an item ends up as, e.g. 'pkg' or 'mod'
+    tail = os.path.basename(what.rstrip('/' + os.sep))
+    return os.path.splitext(tail)[0]
+
+
+def _origin_size(top, what):
+    total = 0
+    try:
+        p = str(top.abspath(what))
+        if os.path.isdir(p):
+            for head, dirs, files in os.walk(p):
+                for f in files:
+                    total += os.path.getsize(os.path.join(head, f))
+        else:
+            total = os.path.getsize(p)
+    except OSError:
+        pass
+    return total
+
+
+def _run_items(top, cmd, cmd_info):
+    # Yield (item, error) for every failed item, in input order.
+    items = cmd_info.items
+    if not isinstance(items, _Lines) and len(items) <= 1:
+        return _run_batch(top, cmd, cmd_info)
+
+    # one look at site-packages for the whole batch, and one write of
+    # the index of each edited directory once it is over
+    from . import index
+    snapshot = cmd_info.snapshot = index.Snapshot(top)
+    def run():
+        try:
+            for what, err in _run_batch(top, cmd, cmd_info):
+                yield what, err
+        finally:
+            snapshot.save()
+    return run()
+
+
+def _run_batch(top, cmd, cmd_info):
+    items = cmd_info.items
+    workers = cmd_info.workers
+    streamed = isinstance(items, _Lines)
+
+    if streamed:
+        progress = _Progress(top, cmd, cmd_info.progress)
+        if workers <= 1:
+            for what in items:
+                err = _run_item(top, cmd, what, cmd_info)
+                progress.tick(err)
+                if err is not None:
+                    yield what, err
+        else:
+            for what, err in _run_stream(top, cmd, cmd_info, progress):
+                yield what, err
+        progress.report()
+        return
+
+    if workers <= 1 or len(items) <= 1:
+        for what in items:
+            err = _run_item(top, cmd, what, cmd_info)
+            if err is not None:
+                yield what, err
+        return
+
+    # Items with the same destination name run one after another
+    # in a single task, so that they never race on a crumb.
+    groups = {}
+    for i, what in enumerate(items):
+        groups.setdefault(_dest_name(what), []).append(i)
+    groups = list(groups.values())
+
+    if cmd == 'copy':
+        # largest first, so that long copies do not land at the tail
+        with top.phase('sizing'):
+            size = [_origin_size(top, what) for what in items]
+        groups.sort(key=lambda g: max(size[i] for i in g), reverse=True)
+
+    errors = [None] * len(items)
+    def run_group(group):
+        for i in group:
+            errors[i] = _run_item(top, cmd, items[i], cmd_info)
+
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_group, g) for g in groups]
+    for f in futures:
+        f.result()
+
+    for what, err in zip(items, errors):
+        if err is not None:
+            yield what, err
+
+
+def _run_stream(top, cmd, cmd_info, progress):
+    # -j over streamed items: a bounded window of items in flight, so
+    # that memory stays flat. An item waits for the previous item with
+    # the same destination name, the pool runs tasks in order.
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor, wait
+    window = 4 * cmd_info.workers
+    last = {}   # destination name -> future of its latest item
+
+    def run(what, before):
+        if before is not None:
+            wait([before])
+        return _run_item(top, cmd, what, cmd_info)
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=cmd_info.workers) as pool:
+        for what in cmd_info.items:
+            name = _dest_name(what)
+            f = pool.submit(run, what, last.get(name))
+            last[name] = f
+            pending.append((what, name, f))
+            while pending and (len(pending) > window or pending[0][2].done()):
+                what, name, f = pending.popleft()
+                if last.get(name) is f:
+                    del last[name]
+                err = f.result()
+                progress.tick(err)
+                if err is not None:
+                    yield what, err
+        for what, name, f in pending:
+            err = f.result()
+            progress.tick(err)
+            if err is not None:
+                yield what, err
 
 
 def indent_error(err):
@@ -214,90 +610,272 @@ def indent_error(err):
 
 def process(argv, top):
 
-    stdout = top.stdout
-    stderr = top.stderr
-
-
     arg = [None] * 10
     arg[:len(argv)] = argv
 
+    opts = _pop_options(arg, switches=('--timings',))
+    if opts.get('--timings'):
+        timings = Timings(top.observer)
+        top.observer = timings
+        try:
+            _process(arg, top)
+        finally:
+            top.observer = timings.chained
+            timings.report(top.stderr)
+    else:
+        _process(arg, top)
+
+
+def _process(arg, top):
+    fmt = _pop_options(arg, valued=('--format',)).get('--format', ['text'])[-1]
+    if fmt not in Emitter.formats:
+        raise SitePathException('Expecting --format to be one of: %s' % (
+            ', '.join(Emitter.formats)))
+    out = None if fmt == 'text' else Emitter(top.stdout, fmt)
+
     cmd = arg[1]
+    handler = COMMANDS.get(cmd)
+    if handler is None:
+        raise SitePathException('Command not recognized: %r' % cmd)
+    handler(top, arg, out)
 
-    if cmd is None:
-        default_info(top)
-        return
 
-    elif cmd in ['-h', '--help', 'help']:
-        show_help(top)
-        return
+def _cmd_status(top, arg, out):
+    default_info(top, out)
 
-    elif cmd in ('symlink', 'unsymlink', 'link', 'unlink',
-                 'copy', 'uncopy', 'develop', 'undevelop', 'info'):
 
-        # allow for short-hand
-        if cmd == 'link':
-            cmd = 'symlink'
-        elif cmd == 'unlink':
-            cmd = 'unsymlink'
+def _cmd_help(top, arg, out):
+    show_help(top)
 
 
-        un = cmd.startswith('un')
-        cmd_info = _proc_args(top, arg[2:], un)
-        collected = []
+def _cmd_ops(top, arg, out):
+    cmd = arg[1]
 
+    # allow for short-hand
+    if cmd == 'link':
+        cmd = 'symlink'
+    elif cmd == 'unlink':
+        cmd = 'unsymlink'
 
-        if cmd_info.items[0] is None:
-            if cmd == 'info':
-                status = _get_status(top)
-                cmd_info.path_to_name = False
-                cmd_info.items = sorted(status.names)
 
-        ecount = 0
-        fcount = 0
-        for what in cmd_info.items:
-            if what is None:
-                if un:
-                    raise SitePathException(
-                        'Need a package name, directory, or file path.')
+    un = cmd.startswith('un')
+    cmd_info = _proc_args(top, arg[2:], un)
+    cmd_info.out = out
+    collected = []
+
+
+    if cmd_info.envs and isinstance(cmd_info.items, _Lines):
+        # every environment runs the whole batch
+        cmd_info.items = list(cmd_info.items)
+
+    given = [] if isinstance(cmd_info.items, _Lines) else cmd_info.items
+
+    if given and given[0] is None and cmd == 'info':
+        from . import ops
+        tops = [(None, top)]
+        if cmd_info.envs:
+            from . import envs
+            tops = envs.env_tops(top, cmd_info.envs)
+        for env, t in tops:
+            if env is not None:
+                if out is not None:
+                    out.emit({'type': 'env', 'env': env})
                 else:
-                    raise SitePathException('Need a directory or file path.')
+                    fprint(top.stdout, '# env %s' % env)
+            with top.phase('info'):
+                ops.info_all(t, cmd_info)
+        if out is not None:
+            out.close()
+        return
+
+    if None in given:
+        if un:
+            raise SitePathException(
+                'Need a package name, directory, or file path.')
+        else:
+            raise SitePathException('Need a directory or file path.')
+
+    if cmd_info.envs:
+        from . import envs
+        results = envs.fan_out(top, cmd, cmd_info, cmd_info.envs, out)
+    else:
+        results = [(None, _run_items(top, cmd, cmd_info))]
+
+    for env, errors in results:
+        for what, err in errors:
+            collected.append((cmd, what, err, env))
+
+    if out is not None:
+        out.close()
+
+    _raise_collected(collected, _count(cmd_info.items) * len(results))
+
+
+def _raise_collected(collected, total):
+    # Report the (cmd, what, error, env) of the failed items of a batch
+    # of `total` items, as a failure if any of them failed.
+    ecount = sum(isinstance(c[2], SitePathException) for c in collected)
+    fcount = sum(isinstance(c[2], SitePathFailure) for c in collected)
+
+    errs = io.StringIO()
+    success = total - len(collected)
+
+    if collected:
+        fprint(errs, '(%i total)' % len(collected))
+        for cmd, what, err, env in collected:
+            where = '' if env is None else ' (env %s)' % env
+            fprint(errs, 'command: %s %r%s\n    - %s' % (
+                cmd, what, where, indent_error(err)))
+
+        if total > 1:
+            fprint(errs, 'Result (success=%i, errors=%i, failures=%i)' % (
+        success, ecount, fcount))
+
+    s = errs.getvalue()
+    if fcount:
+        raise SitePathFailure(s)
+    elif ecount:
+        raise SitePathException(s)
+
+
+def _cmd_watch(top, arg, out):
+    from . import watch
+    opts = _pop_options(arg, valued=('--interval', '--max-interval',
+                                     '--settle', '--cycles'))
+    cmd_info = _proc_args(top, arg[2:], False)
+    if cmd_info.envs:
+        raise SitePathException('watch does not support --env')
+    from . import ops
+    # a name, or the path of an origin, as for uncopy
+    names = set(ops._uncommand(top, what).ident
+                for what in cmd_info.items if what is not None)
+
+    def get_copies():
+        return [p for p in _get_status(top).copies
+                if not names or os.path.splitext(p.name)[0] in names]
+
+    missing = names.difference(os.path.splitext(p.name)[0]
+                               for p in get_copies())
+    if missing:
+        raise SitePathException('watch: not a copied package: %s' % (
+            ', '.join(sorted(missing))))
+
+    try:
+        watch.watch(top, cmd_info, get_copies,
+            interval=_float_option(opts, '--interval', 1.0),
+            max_interval=_float_option(opts, '--max-interval', 30.0),
+            settle=_float_option(opts, '--settle', 1.0),
+            cycles=_int_option(opts, '--cycles', None))
+    except KeyboardInterrupt:
+        fprint(top.stdout, 'watch: stopped')
+
+
+def _cmd_startup_cost(top, arg, out):
+    from . import startup
+    opts = _pop_options(arg, valued=('--env', '--repeat'))
+    repeat = _int_option(opts, '--repeat', 5)
+    if arg[2] is not None:
+        raise SitePathException('not recognized: %r' % arg[2])
+
+    python = sys.executable
+    if '--env' in opts:
+        from . import envs
+        python = envs.interpreter(top, opts['--env'][-1])
+        top = envs.env_top(top, python)
+
+    entries = [e for e in _iter_status(top) if e.kind != 'pth']
+    with top.phase('startup-cost', python):
+        r = startup.measure(python, entries, repeat)
+    startup.report(top, r, out)
+
+
+def _cmd_sync(top, arg, out):
+    from . import sync
+    plan_only = _pop_options(arg, switches=('--plan',)).get('--plan', False)
+    flags = _proc_args(top, arg[2:], False)
+    flags.out = out
+    if not isinstance(flags.items, list) or len(flags.items) != 1 \
+            or flags.items[0] is None:
+        raise SitePathException('Expecting one manifest file.')
+    if flags.envs:
+        raise SitePathException('sync does not take --env or --envs-from')
+
+    wanted = sync.read_manifest(top, flags.items[0])
+    with top.phase('plan'):
+        steps = sync.plan(top, wanted, flags.exclude)
+    sync.report(top, steps, out)
+    if out is not None:
+        out.close()
+    if plan_only:
+        return
+
+    collected, total = sync.apply(top, steps, flags)
+    _raise_collected(collected, total)
+
+
+def _cmd_registry(top, arg, out):
+    from . import index, registry
+    opts = _pop_options(arg, valued=('--name', '--origin', '--kind'))
+    what = arg[2]
+
+    if what in ('init', 'drop'):
+        # Directories that cannot be written, such as a system
+        # site-packages ahead of the user site, are skipped.
+        tried = []
+        for d in top.asp:
             try:
-                func = getattr(ops, cmd)
-                func(top, what, cmd_info)
-            except (SitePathException, SitePathFailure) as err:
-                if isinstance(err, SitePathException):
-                    ecount += 1
-                elif isinstance(err, SitePathFailure):
-                    fcount += 1
-                collected.append((what, err))
-
-        errs = io.StringIO()
-        success = len(cmd_info.items) - len(collected)
-
-        if collected:
-            fprint(errs, '(%i total)' % len(collected))
-            for what, err in collected:
-                fprint(errs, 'command: %s %r\n    - %s' % (cmd, what, indent_error(err)))
-
-            if len(cmd_info.items) > 1:
-                fprint(errs, 'Result (success=%i, errors=%i, failures=%i)' % (
-            success, ecount, fcount))
-
-        s = errs.getvalue()
-        if fcount:
-            raise SitePathFailure(s)
-        elif ecount:
-            raise SitePathException(s)
-
-    elif cmd == 'mvp':
-        what = arg[2]
-        if what is None:
-            raise SitePathException('Need a project name')
-        p = os.path.abspath(what)
-        head, tail = os.path.split(p)
-        name, _ = os.path.splitext(tail)
+                with index.editing(d):
+                    if what == 'init':
+                        # filled from the crumbs as the edit ends
+                        registry.create(d)
+                        json_index = os.path.join(d, index.INDEX)
+                        if os.path.exists(json_index):
+                            os.remove(json_index)
+                    else:
+                        registry.drop(d)
+            except Exception as err:    # OSError, or sqlite3.Error
+                tried.append('%r: %s' % (d, err))
+                fprint(top.stderr, 'note: unable to %s the registry of %r: %s'
+                       % (what, d, err))
+                continue
+            fprint(top.stdout, 'registry %s: %r' % (what, registry.path(d)))
+        if tried and len(tried) == len(top.asp):
+            raise SitePathFailure('Unable to %s a registry anywhere.\n    %s' % (
+                what, '\n    '.join(tried)))
+
+    elif what == 'query':
+        from . import ops
+        last = lambda k: opts[k][-1] if k in opts else None
+        origin = last('--origin')
+        if origin is not None:
+            origin = str(top.abspath(origin))
+        for d in top.asp:
+            for rec in index.query(d, last('--name'), origin, last('--kind')):
+                if rec['kind'] == 'pth':
+                    continue
+                p = os.path.join(d, rec['entry'])
+                c = rec.get('crumb') or {}
+                if out is not None:
+                    out.emit(ops._record(rec['kind'], p, rec['name'], d, c))
+                else:
+                    fprint(top.stdout, '%-8s %s  %s' % (
+                        rec['kind'], p, c.get('from', '# error: no crumb')))
+        if out is not None:
+            out.close()
+
+    else:
+        raise SitePathException('Expecting "init", "drop", or "query".')
+
 
-        src = '''# (redirect output) > pyproject.toml
+def _cmd_mvp(top, arg, out):
+    what = arg[2]
+    if what is None:
+        raise SitePathException('Need a project name')
+    p = os.path.abspath(what)
+    head, tail = os.path.split(p)
+    name, _ = os.path.splitext(tail)
+
+    src = '''# (redirect output) > pyproject.toml
 # See: https://packaging.python.org/en/latest/tutorials/packaging-projects/
 [project]
 name = %s
@@ -311,81 +889,188 @@ version = "0.0.0"
 # urls = {"Home-page" = "http://example.com"}
 ''' % repr(name)
 
-        fprint(stdout, src)
+    fprint(top.stdout, src)
+
 
+def _cmd_list(top, arg, out):
+    stdout = top.stdout
 
-    elif cmd == 'list':
-        what = arg[2]
+    opts = _pop_options(arg, valued=('-j',),
+                        switches=('--deep', '--unordered'))
+    deep = opts.get('--deep', False)
+    ordered = not opts.get('--unordered', False)
+    jobs = _int_option(opts, '-j', min(8, os.cpu_count() or 1))
+    what = arg[2]
+    if what is None:
+        raise SitePathException(
+            'Expecting "symlinks", "copies", "zips", "develops", "all" , or '
+            '"changed".')
+
+    todo = set()
+    for what in arg[2:]:
         if what is None:
-            raise SitePathException(
-                'Expecting "symlinks", "copies", "develops", "all" , or "changed".')
-        status = _get_status(top)
-
-        todo = set()
-        for what in arg[2:]:
-            if what is None:
-                break
-
-            if what in ['symlinks', 'syms', 'sym', 'symlinked', 'symlink', 's',
-                        'links', 'link', 'linked']:
-                todo.add('symlinks')
-            elif what in ['copies', 'copy', 'copied', 'c']:
-                todo.add('copies')
-            elif what in ['develops', 'dev', 'devs', 'developed', 'develop', 'd']:
-                todo.add('develops')
-            elif what in ['all']:
-                todo.update(['symlinks', 'copies', 'develops'])
-            elif what in ['changed', 'change', 'changes']:
-                todo.add('changes')
-            else:
-                raise SitePathException('not recognized: %r' % what)
-
-        if 'symlinks' in todo:
-            fprint(stdout, '# sitepath-symlinked')
-            for p in status.syms:
-                try:
-                    fprint(stdout, os.readlink(p))
-                except OSError:
-                    fprint(stdout, '# Error: unable to readlink %r' % p)
-
-        if 'copies' in todo:
-            fprint(stdout, '# sitepath-copied')
-            for p in status.copies:
-                c, cfile = get_crumb(p)
-                fprint(stdout,  c.get('from', '# error: %r' % p))
-
-        if 'changes' in todo:
-            fprint(stdout, '# sitepath-copied and different')
-            for p in status.copies:
-                try:
-                    cr = ops._compare_crumb(p)
-                except SitePathFailure as f:
-                    fprint(stdout, '# ' + str(f))
-                    continue
+            break
+
+        if what in ['symlinks', 'syms', 'sym', 'symlinked', 'symlink', 's',
+                    'links', 'link', 'linked']:
+            todo.add('symlinks')
+        elif what in ['copies', 'copy', 'copied', 'c']:
+            todo.add('copies')
+        elif what in ['zips', 'zip', 'zipped', 'z']:
+            todo.add('zips')
+        elif what in ['develops', 'dev', 'devs', 'developed', 'develop', 'd']:
+            todo.add('develops')
+        elif what in ['all']:
+            todo.update(['symlinks', 'copies', 'zips', 'develops'])
+        elif what in ['changed', 'change', 'changes']:
+            todo.add('changes')
+        else:
+            raise SitePathException('not recognized: %r' % what)
+
+    if out is not None:
+        _emit_list(top, todo, out, deep, jobs, ordered)
+        return
 
+    status = _get_status(top)
+
+    if 'symlinks' in todo:
+        fprint(stdout, '# sitepath-symlinked')
+        for p in status.syms:
+            try:
+                fprint(stdout, os.readlink(p))
+            except OSError:
+                fprint(stdout, '# Error: unable to readlink %r' % p)
+
+    if 'copies' in todo:
+        fprint(stdout, '# sitepath-copied')
+        for p in status.copies:
+            c = status.crumbs[p]
+            fprint(stdout,  c.get('from', '# error: %r' % p))
+
+    if 'zips' in todo:
+        fprint(stdout, '# sitepath-zipped')
+        for p in status.zips:
+            c = status.crumbs[p]
+            fprint(stdout,  c.get('from', '# error: %r' % p))
+
+    if 'changes' in todo:
+        fprint(stdout, '# sitepath-copied and different')
+        from . import ops
+        for p, cr, _ in ops._compare_crumbs(
+                status.copies + status.zips, deep, jobs, ordered,
+                top.observer):
+            if isinstance(cr, SitePathFailure):
+                fprint(stdout, '# ' + str(cr))
+                continue
+
+            if cr.stale:
+                fprint(stdout, '# stale bytecode for %i source file(s): %s' % (
+                    len(cr.stale), p))
+            if cr.changed or cr.stale:
+                fprint(stdout, cr.origin)
+
+        linked = [('symlink', p, status.crumbs[p]) for p in status.syms]
+        linked.extend(('develop', p, c)
+                      for p, c in zip(status.dev, status.dev_crumbs))
+        for kind, p, c in linked:
+            stale = ops._stale_linked(kind, p, c)
+            if stale:
+                fprint(stdout, '# stale bytecode for %i source file(s): %s' % (
+                    len(stale), p))
+
+    if 'develops' in todo:
+        fprint(stdout, '# sitepath-developed')
+        for d, c in zip(status.dev, status.dev_crumbs):
+            if c is None:
+                fprint(stdout, '# error: unable to open %r' % d)
+                continue
+
+            f = c.get('from')
+            if f is None:
+                f = '# error: missing "from" in %r' % (str(d),)
+            fprint(stdout, f)
+
+
+# command name -> handler(top, arg, out). The handlers import what
+# they need, so that a quick `help` or `mvp` does not load ops.
+COMMANDS = {
+    None: _cmd_status,
+    'help': _cmd_help, '-h': _cmd_help, '--help': _cmd_help,
+    'watch': _cmd_watch,
+    'startup-cost': _cmd_startup_cost,
+    'registry': _cmd_registry,
+    'sync': _cmd_sync,
+    'mvp': _cmd_mvp,
+    'list': _cmd_list,
+}
+for _cmd in ('symlink', 'unsymlink', 'link', 'unlink', 'copy', 'uncopy',
+             'develop', 'undevelop', 'zip', 'unzip', 'info'):
+    COMMANDS[_cmd] = _cmd_ops
+del _cmd
+
+
+def _emit_list(top, todo, out, deep, jobs, ordered):
+    # `list` for --format json/ndjson, one record per package
+    kinds = {'symlinks': 'symlink', 'copies': 'copy', 'zips': 'zip',
+             'develops': 'develop'}
+    wanted = {kinds[t] for t in todo if t in kinds}
+    from . import ops
+
+    copies = {}
+    linked = []
+    for entry in _iter_status(top):
+        if entry.kind in wanted:
+            out.emit(ops._record(entry.kind, entry.path, entry.name,
+                                 entry.site, entry.crumb))
+        if entry.kind in ('copy', 'zip') and 'changes' in todo:
+            copies[entry.path] = entry
+        elif entry.kind in ('symlink', 'develop') and 'changes' in todo:
+            linked.append(entry)
+
+    for entry in linked:
+        stale = ops._stale_linked(entry.kind, entry.path, entry.crumb)
+        if stale:
+            rec = ops._record(entry.kind, entry.path, entry.name,
+                              entry.site, entry.crumb)
+            rec['stale_bytecode'] = stale
+            rec['status'] = 'stale'
+            out.emit(rec)
+
+    if 'changes' in todo:
+        for p, cr, elapsed in ops._compare_crumbs(
+                list(copies), deep, jobs, ordered, top.observer):
+            entry = copies[p]
+            rec = ops._record(entry.kind, p, entry.name, entry.site,
+                              entry.crumb)
+            rec['seconds'] = elapsed
+            if isinstance(cr, SitePathFailure):
+                rec['status'] = 'error'
+                rec['error'] = str(cr)
+            else:
+                rec['changed'] = cr.changed
+                rec['stale_bytecode'] = cr.stale
                 if cr.changed:
-                    fprint(stdout, cr.origin)
-
-        if 'develops' in todo:
-            fprint(stdout, '# sitepath-developed')
-            for d in status.dev:
-                try:
-                    c, cfile = get_pth(d)
-                except OSError:
-                    fprint(stdout, '# error: unable to open %r' % d)
-                    continue
+                    rec['status'] = 'changed'
+                elif cr.stale:
+                    rec['status'] = 'stale'
+            out.emit(rec)
 
-                if c is None:
-                    fprint(stdout, '# error: unable to open %r' % d)
-                    continue
+    out.close()
 
-                f = c.get('from')
-                if f is None:
-                    f = '# error: missing "from" in %r' % (str(d),)
-                fprint(stdout, f)
 
-    else:
-        raise SitePathException('Command not recognized: %r' % cmd)
+def _iter_status(top):
+    # Stream the .pth files and sitepath-managed entries of every
+    # active site-packages directory, one directory at a time. Records
+    # come from the per-directory index, which is rebuilt with a single
+    # scandir pass when stale.
+    from pathlib import Path
+    from . import index
+    for d in top.asp:
+        with top.phase('scan', d):
+            recs = index.records(d)
+        for rec in recs:
+            yield result(kind=rec['kind'], path=Path(d, rec['entry']),
+                         name=rec['name'], site=d, crumb=rec.get('crumb'))
 
 
 def _get_status(top):
@@ -394,35 +1079,57 @@ def _get_status(top):
 
     dev = []
     pth = []
-    for d in top.asp:
-        d = pathlib.Path(d)
-        pth_list = sorted(d.glob('*.pth'))
-        for name in pth_list:
-            pth.append(name)
-            if str(name).endswith('.sitepath.pth'):
-                dev.append(name)
-                n, _, _ = name.name.rsplit('.', maxsplit=2)
-                names.add(n)
-
     syms = []
     copies = []
 
-    for d in top.asp:
-        d = pathlib.Path(d)
-        if d.is_dir():
-            for item in sorted(d.iterdir()):
-                if has_crumb(item):
-                    if item.is_symlink():
-                        syms.append(item)
-                        names.add(item.name)
-                    else:
-                        copies.append(item)
-                        names.add(item.name)
+    crumbs = {}   # path -> parsed crumb
+    dev_crumbs = []   # crumbs of `dev`, which may share a sitepath.pth
+
+    zips = []
+
+    lists = {'pth': pth, 'develop': dev, 'symlink': syms, 'copy': copies,
+             'zip': zips}
+    for entry in _iter_status(top):
+        lists[entry.kind].append(entry.path)
+        if entry.kind != 'pth':
+            names.add(entry.name)
+            crumbs[entry.path] = entry.crumb
+        if entry.kind == 'develop':
+            dev_crumbs.append(entry.crumb)
+
+    return result._using(
+        'dev, pth, syms, copies, zips, names, crumbs, dev_crumbs', locals())
+
+
+def _emit_status(top, out):
+    # default_info for --format json/ndjson
+    from . import ops
+    out.emit({
+        'type': 'environment',
+        'version': __version__,
+        'env': {k: top.env[k] for k in ('VIRTUAL_ENV', 'PYTHONPATH',
+                                         'PYTHONHOME') if k in top.env},
+        'executable': sys.executable,
+        'sys_path': list(top.syspath),
+        'user_site': top.usp,
+        'user_site_exists': top.usp is not None and os.path.isdir(top.usp),
+        'enable_user_site': top.enable_user_site,
+        'site_packages': [str(p) for p in top.orig_asp],
+    })
+    for entry in _iter_status(top):
+        if entry.kind == 'pth':
+            out.emit({'type': 'pth', 'path': str(entry.path),
+                      'site': str(entry.site)})
+        else:
+            out.emit(ops._record(entry.kind, entry.path, entry.name,
+                                 entry.site, entry.crumb))
+    out.close()
 
-    return result._using('dev, pth, syms, copies, names', locals())
 
+def default_info(top, out=None):
+    if out is not None:
+        return _emit_status(top, out)
 
-def default_info(top):
     stdout = top.stdout
     print = lambda *args, **kw: fprint(stdout, *args, **kw)
 
@@ -458,38 +1165,59 @@ def default_info(top):
     for p in top.orig_asp:
         print( '    %s' % str(p))
 
-    status = _get_status(top)
     print()
     print( 'Active .pth files:')
 
-    for name in status.pth:
-        print( '    %s' % str(name))
-
-    syms = status.syms
-    copies = status.copies
-    dev = status.dev
+    # .pth files are printed as they are found, only the
+    # sitepath-managed entries are kept for the summary.
+    syms = []
+    copies = []
+    zips = []
+    dev = []
+    lists = {'develop': dev, 'symlink': syms, 'copy': copies, 'zip': zips}
+    crumbs = {}
+    for entry in _iter_status(top):
+        if entry.kind == 'pth':
+            print( '    %s' % str(entry.path))
+        elif entry.kind == 'develop':
+            dev.append((entry.path, entry.crumb))
+        else:
+            lists[entry.kind].append(entry.path)
+            crumbs[entry.path] = entry.crumb
 
     print()
-    print( 'sitepath-symlinked packages: %i found' % len(status.syms))
-    for s in status.syms:
+    print( 'sitepath-symlinked packages: %i found' % len(syms))
+    for s in syms:
         src = s.readlink()
         if os.path.exists(src):
             print( '    %s --> %s' % (s, src))
         else:
             print( '!!! %s --> %s (broken)' % (s, src))
 
-    print( 'sitepath-copied packages:    %i found' % len(status.copies))
-    for s in status.copies:
-        c, cfile = get_crumb(s)
+    print( 'sitepath-copied packages:    %i found' % len(copies))
+    for s in copies:
+        c = crumbs[s] or {}
         src = c.get('from', '# error: %r' % c)
         if os.path.exists(src):
             print( '    %s <-- %s' % (s, src))
         else:
             print( "?   %s <-- %s (doesn't exist)" % (s, src))
 
-    print( 'sitepath-developed packages: %i found' % len(status.dev))
-    for s in status.dev:
-        c, cfile = get_pth(s)
+    print( 'sitepath-zipped packages:    %i found' % len(zips))
+    for s in zips:
+        c = crumbs[s] or {}
+        src = c.get('from', '# error: %r' % c)
+        if os.path.exists(src):
+            print( '    %s <== %s' % (s, src))
+        else:
+            print( "?   %s <== %s (doesn't exist)" % (s, src))
+
+    print( 'sitepath-developed packages: %i found' % len(dev))
+    from .crumb import SHARED_PTH, FINDER_PTH
+    for s, c in dev:
+        c = c or {}
+        if s.name in (SHARED_PTH, FINDER_PTH):
+            s = '%s[%s]' % (s, c.get('base'))
         src = c.get('pth', ['# error: %r' % s])
         if len(src) == 1:
             print( '    %s  >>>  %s' % (s, src[0]))
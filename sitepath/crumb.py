@@ -52,6 +52,27 @@ def get_crumb(p):
     return d, f
 
 
+def place_manifest(p, m):
+    f = norm_path(p) + '.sitepath.manifest'
+    with open(f, 'w') as fp:
+        json.dump(m, fp)
+
+
+def get_manifest(p):
+    f = norm_path(p) + '.sitepath.manifest'
+    try:
+        with open(f, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_manifest(p):
+    f = norm_path(p) + '.sitepath.manifest'
+    if os.path.isfile(f):
+        os.remove(f)
+
+
 def get_pth(p):
     p = str(p)
     if not p.endswith('.sitepath.pth'):
@@ -87,3 +108,84 @@ def get_pth(p):
         d['pth'].append(line.strip())
 
     return d, p
+
+
+# A consolidated .pth file for `develop --shared-pth`: one crumb line
+# per package, then each parent directory once.
+SHARED_PTH = 'sitepath.pth'
+
+# Likewise for `develop --finder`, ending with one import line that
+# installs the finder with a name -> path map instead of the directories.
+FINDER_PTH = 'sitepath-finder.pth'
+FINDER_MODULE = '_sitepath_finder'
+
+
+def get_shared_pth(p):
+    # {name: crumb} of a consolidated .pth file, or None if missing.
+    # Each crumb gets a 'pth' list like get_pth, empty when its
+    # directory line was removed by hand.
+    p = str(p)
+    if not os.path.isfile(p):
+        return None
+
+    with open(p, 'r') as fp:
+        lines = fp.readlines()
+
+    crumbs = {}
+    dirs = set()
+    paths = {}
+    for line in lines:
+        if line.startswith('# sitepath:'):
+            pre, sep, js = line.partition(':')
+            try:
+                d = json.loads(js.strip())
+                crumbs[d['base']] = d
+            except (ValueError, TypeError, KeyError):
+                pass
+        elif line.startswith('import '):
+            try:
+                paths.update(json.loads(
+                    line[line.index('(') + 1:line.rindex(')')]))
+            except ValueError:
+                pass
+        elif line.strip() and not line.startswith('#'):
+            dirs.add(line.strip())
+
+    for name, d in crumbs.items():
+        if paths:
+            d['pth'] = [paths[name]] if name in paths else []
+            continue
+        head = os.path.dirname(d.get('from', ''))
+        d['pth'] = [head] if head in dirs else []
+    return crumbs
+
+
+def place_shared_pth(p, crumbs, finder=False):
+    # Replace the consolidated .pth file in one rename, or remove it
+    # when no package is left.
+    p = str(p)
+    if not crumbs:
+        if os.path.exists(p):
+            os.remove(p)
+        return
+
+    lines = []
+    dirs = []
+    paths = {}
+    for name in sorted(crumbs):
+        d = {k: v for k, v in crumbs[name].items() if k != 'pth'}
+        lines.append('# sitepath: %s\n' % json.dumps(d, sort_keys=True))
+        paths[name] = d['from']
+        head = os.path.dirname(d['from'])
+        if head not in dirs:
+            dirs.append(head)
+    if finder:
+        lines.append('import %s; %s.install(%s)\n' % (
+            FINDER_MODULE, FINDER_MODULE, json.dumps(paths, sort_keys=True)))
+    else:
+        lines.extend(head + '\n' for head in dirs)
+
+    tmp = p + '.tmp'
+    with open(tmp, 'w') as fp:
+        fp.writelines(lines)
+    os.replace(tmp, p)
@@ -0,0 +1,153 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# Run one batch against the site-packages of several interpreters,
+# given as --env <venv or python> or listed in --envs-from <file>.
+
+import os
+import sys
+import json
+import subprocess
+
+from .common import *
+from . import core
+
+# what a SitePathTop needs to know about the target interpreter
+_QUERY = '''if 1:
+    import json, site, sys
+    print(json.dumps({
+        'sp': site.getsitepackages(),
+        'usp': site.getusersitepackages(),
+        'enable_user_site': site.ENABLE_USER_SITE,
+        'syspath': sys.path,
+        'prefix': sys.prefix,
+        'base_prefix': getattr(sys, 'base_prefix', sys.prefix),
+    }))
+'''
+
+
+def read_envs(top, file):
+    # --envs-from lines, skipping blanks and comments
+    p = top.abspath(file)
+    try:
+        with open(str(p), 'r') as fp:
+            lines = [line.strip() for line in fp]
+    except OSError:
+        raise SitePathException('File not found %r' % str(p))
+    return [line for line in lines if line and line[0] != '#']
+
+
+def interpreter(top, env):
+    # The python of a virtual environment, or the interpreter itself.
+    p = str(top.abspath(env))
+    if os.path.isdir(p):
+        if sys.platform == 'win32':
+            exe = os.path.join(p, 'Scripts', 'python.exe')
+        else:
+            exe = os.path.join(p, 'bin', 'python')
+        if os.path.exists(exe):
+            return exe
+        raise SitePathException('No interpreter in environment: %r' % p)
+    if os.path.isfile(p):
+        return p
+    raise SitePathException('Environment not found: %r' % p)
+
+
+def query(python):
+    try:
+        proc = subprocess.run([python, '-E', '-c', _QUERY],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+    except OSError as err:
+        raise SitePathFailure('Unable to run %r: %s' % (python, err))
+    if proc.returncode:
+        raise SitePathFailure('Unable to query %r:\n%s' % (
+            python, proc.stderr.strip()))
+    return json.loads(proc.stdout)
+
+
+def env_top(top, python):
+    # A SitePathTop for the target interpreter, sharing the output,
+    # working directory, time stamp and observer of `top`.
+    info = query(python)
+    env = dict(top.env)
+    env.pop('VIRTUAL_ENV', None)
+    if info['prefix'] != info['base_prefix']:
+        env['VIRTUAL_ENV'] = info['prefix']
+    return core.SitePathTop(
+        sp=info['sp'],
+        usp=info['usp'],
+        syspath=info['syspath'],
+        cwd=top.cwd,
+        stdout=top.stdout,
+        stderr=top.stderr,
+        enable_user_site=info['enable_user_site'],
+        now=top.now,
+        env=env,
+        observer=top.observer,
+        stdin=top.stdin)
+
+
+def _pool(envs):
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(
+        max_workers=min(len(envs), 2 * (os.cpu_count() or 1)))
+
+
+def _tops(top, envs, pool):
+    pythons = [interpreter(top, env) for env in envs]
+    with top.phase('envs'):
+        return list(pool.map(lambda p: env_top(top, p), pythons))
+
+
+def env_tops(top, envs):
+    # [(env, SitePathTop)] for each of `envs`, queried at once.
+    with _pool(envs) as pool:
+        return list(zip(envs, _tops(top, envs, pool)))
+
+
+def fan_out(top, cmd, cmd_info, envs, out=None):
+    # Run `cmd` over the items of `cmd_info` in every environment at
+    # once. Copies of the same origin share its scan and file hashes.
+    # Returns [(env, collected errors)] in the order of `envs`.
+    from .copier import OriginCache
+
+    with _pool(envs) as pool:
+        tops = _tops(top, envs, pool)
+
+        cmd_info.cache = OriginCache()
+
+        def run(t):
+            # a copy of cmd_info per environment, for its own snapshot
+            flags = result(vars(cmd_info))
+            with top.phase('env', t.sp[0] if t.sp else None):
+                return list(core._run_items(t, cmd, flags))
+        results = list(pool.map(run, tops))
+
+    stdout = top.stdout
+    for env, collected in zip(envs, results):
+        ecount = sum(isinstance(err, SitePathException)
+                     for what, err in collected)
+        fcount = len(collected) - ecount
+        success = len(cmd_info.items) - len(collected)
+        if out is not None:
+            out.emit({'type': 'env', 'env': env, 'success': success,
+                      'errors': ecount, 'failures': fcount})
+        else:
+            fprint(stdout, '# env %s (success=%i, errors=%i, failures=%i)' % (
+                env, success, ecount, fcount))
+
+    return list(zip(envs, results))
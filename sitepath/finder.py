@@ -0,0 +1,68 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# The import finder of `develop --finder`. This file is copied to
+# site-packages as _sitepath_finder.py and installed by the import line
+# of sitepath-finder.pth, so it must not import anything from sitepath.
+
+import os
+import sys
+import importlib.util
+import importlib.machinery
+
+
+class SitePathFinder:
+    # Finds developed top-level packages by exact name. Their
+    # submodules are found through the package __path__ as usual.
+
+    def __init__(self, paths):
+        self.paths = dict(paths)    # name -> package directory or file
+
+    def find_spec(self, name, path=None, target=None):
+        p = self.paths.get(name)
+        if p is None or path is not None:
+            return None
+        if os.path.isdir(p):
+            init = os.path.join(p, '__init__.py')
+            if os.path.isfile(init):
+                return importlib.util.spec_from_file_location(
+                    name, init, submodule_search_locations=[p])
+            spec = importlib.machinery.ModuleSpec(name, None, is_package=True)
+            spec.submodule_search_locations = [p]   # namespace package
+            return spec
+        if os.path.isfile(p):
+            return importlib.util.spec_from_file_location(name, p)
+        return None
+
+    def invalidate_caches(self):
+        pass
+
+
+def install(paths):
+    # Add the finder just before the sys.path based finder, so that
+    # builtin and frozen modules still come first.
+    for f in sys.meta_path:
+        if type(f).__name__ == 'SitePathFinder':
+            f.paths.update(paths)
+            return f
+    finder = SitePathFinder(paths)
+    for i, f in enumerate(sys.meta_path):
+        if f is importlib.machinery.PathFinder:
+            sys.meta_path.insert(i, finder)
+            break
+    else:
+        sys.meta_path.append(finder)
+    return finder
@@ -0,0 +1,103 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# Files left out of a copied directory: the defaults below, the lines
+# of .sitepathignore in the origin, and --exclude patterns. The
+# patterns are recorded in the crumb, so that `list changed` and
+# `watch` look at the same files as the copy did.
+#
+# A pattern is matched against the name of each file and directory,
+# or against its path below the origin if it contains a '/'. A
+# trailing '/' matches directories only. (.git is a file in a git
+# worktree, so it is left out either way.) Unlike .gitignore, there
+# is no negation: a pattern starting with '!' is rejected.
+
+import os
+import fnmatch
+import filecmp
+
+from .common import *
+
+IGNORE_FILE = '.sitepathignore'
+
+DEFAULTS = (
+    '.git', '.hg/', '.svn/', '.tox/', '.nox/', 'node_modules/',
+    '__pycache__/', '.mypy_cache/', '.pytest_cache/', '.ruff_cache/',
+    '*.py[co]', '.DS_Store', IGNORE_FILE,
+)
+
+
+class IgnoreRules:
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self._rules = []    # (pattern, directories only, path pattern)
+        for pat in self.patterns:
+            dir_only = pat.endswith('/')
+            pat = pat.rstrip('/')
+            anchored = '/' in pat
+            self._rules.append((pat.lstrip('/'), dir_only, anchored))
+
+    def __call__(self, rel, is_dir):
+        # Whether `rel`, a path below the origin, is left out.
+        rel = rel.replace(os.sep, '/')
+        name = rel.rpartition('/')[2]
+        for pat, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatchcase(rel if anchored else name, pat):
+                return True
+        return False
+
+    def excludes(self, rel):
+        # Whether the file `rel` is left out, by itself or by one of the
+        # directories above it.
+        parts = rel.replace(os.sep, '/').split('/')
+        for i in range(1, len(parts)):
+            if self('/'.join(parts[:i]), True):
+                return True
+        return self(rel, False)
+
+
+def read_ignore_file(origin):
+    # The patterns of `origin`/.sitepathignore, if there is one.
+    try:
+        with open(os.path.join(str(origin), IGNORE_FILE), 'r') as fp:
+            lines = [line.strip() for line in fp]
+    except OSError:
+        return []
+    return [line for line in lines if line and line[0] != '#']
+
+
+def copy_patterns(origin, exclude=()):
+    # Every pattern that applies to a copy of `origin`, in order.
+    patterns = []
+    for pat in list(DEFAULTS) + read_ignore_file(origin) + list(exclude):
+        if pat.startswith('!'):
+            raise SitePathException(
+                'Negated ignore patterns are not supported: %r' % pat)
+        if pat not in patterns:
+            patterns.append(pat)
+    return patterns
+
+
+def crumb_rules(c):
+    # The rules a copy was made with. A copy that predates them has
+    # every file of its origin, and is compared the way filecmp.dircmp
+    # compared it, without version control files and __pycache__.
+    patterns = (c or {}).get('exclude')
+    if patterns is None:
+        patterns = filecmp.DEFAULT_IGNORES
+    return IgnoreRules(patterns)
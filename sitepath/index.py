@@ -0,0 +1,453 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# A per site-packages cache of the sitepath-managed entries and their
+# parsed crumbs. It is trusted while the directory mtime and every
+# crumb mtime match what was recorded, so a warm lookup only stats
+# the directory and the crumbs. A SQLite registry takes the place of
+# the JSON file where one was created, see registry.py.
+#
+# Only the commands that change a directory write its index; reading
+# never creates or updates one. An mtime within RACY of the moment the
+# index was taken may hide a later change in the same clock tick, so
+# such a directory is listed again and such crumbs are read again.
+
+import os
+import json
+import time
+import threading
+
+from .crumb import *
+from . import registry
+
+INDEX = '.sitepath-index.json'
+VERSION = 2
+
+RACY = 2 * 10**9    # ns, the coarsest mtime granularity (FAT)
+
+
+def _mtime(p):
+    try:
+        return os.stat(p).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _now():
+    return int(time.time() * 10**9)
+
+
+def _crumb_file(d, rec):
+    if rec['kind'] == 'develop':
+        return os.path.join(d, rec['entry'])
+    return os.path.join(d, rec['entry'] + '.sitepath')
+
+
+def _order(rec):
+    # .pth files (and the develops they hold) first, then crumbs
+    kind = rec['kind']
+    return (kind not in ('pth', 'develop'), rec['entry'], kind != 'pth')
+
+
+def _probe(d, entry, is_link=None):
+    # Records for a single directory entry, found by name.
+    recs = []
+    p = os.path.join(d, entry)
+    if entry.endswith('.pth'):
+        if not os.path.isfile(p):
+            return recs     # removed, or never created
+        recs.append({'kind': 'pth', 'entry': entry, 'name': entry})
+        if entry.endswith('.sitepath.pth'):
+            n, _, _ = entry.rsplit('.', maxsplit=2)
+            try:
+                c, _ = get_pth(p)
+            except OSError:
+                c = None    # reported as unreadable by the callers
+            recs.append({'kind': 'develop', 'entry': entry, 'name': n,
+                         'mtime': _mtime(p), 'crumb': c})
+        elif entry in (SHARED_PTH, FINDER_PTH):
+            try:
+                crumbs = get_shared_pth(p) or {}
+            except OSError:
+                crumbs = {}
+            mtime = _mtime(p)
+            for n, c in crumbs.items():
+                recs.append({'kind': 'develop', 'entry': entry, 'name': n,
+                             'mtime': mtime, 'crumb': c})
+        return recs
+
+    if is_link is None:
+        if not os.path.lexists(p):
+            return recs     # a crumb without its package
+        is_link = os.path.islink(p)
+
+    cfile = p + '.sitepath'
+    try:
+        c, _ = get_crumb(p)
+    except OSError:
+        c = {}
+    if c is None:
+        return recs
+    kind = 'symlink' if is_link else 'copy'
+    if isinstance(c, dict) and c.get('how') == 'zip':
+        kind = 'zip'
+    recs.append({'kind': kind, 'entry': entry, 'name': entry,
+                 'mtime': _mtime(cfile), 'crumb': c})
+    return recs
+
+
+def _entries(d):
+    # The names that the records of `d` depend on, from a single
+    # scandir pass: [.pth files, [[crumbed entry, is_symlink]]]. Entry
+    # types come from d_type, so no per-entry stat.
+    pth = []
+    crumbs = []
+    links = {}   # entry name -> is_symlink
+    with os.scandir(d) as it:
+        for entry in it:
+            name = entry.name
+            if name.endswith('.pth'):
+                pth.append(name)
+            elif name.endswith('.sitepath'):
+                if entry.is_file():
+                    crumbs.append(name[:-len('.sitepath')])
+            links[name] = entry.is_symlink()
+    # a crumb without its package has no records
+    return [sorted(pth), sorted([name, links[name]] for name in crumbs
+                                if name in links)]
+
+
+def _scan(d, entries):
+    pth, crumbs = entries
+    recs = []
+    for name in pth:
+        recs.extend(_probe(d, name))
+    for name, is_link in crumbs:
+        recs.extend(_probe(d, name, is_link))
+    recs.sort(key=_order)
+    return recs
+
+
+def scan(d):
+    # Classify one site-packages directory.
+    return _scan(d, _entries(d))
+
+
+def _fresh(d, idx):
+    # The records of the index `idx`, or None if it is stale. Crumbs
+    # changed too close to when the index was taken are read again.
+    mtime = idx.get('mtime')
+    since = idx.get('since')
+    if mtime is None or since is None or mtime != _mtime(d):
+        return None
+    try:
+        if since - mtime < RACY and idx.get('entries') != _entries(d):
+            return None
+    except OSError:
+        return None
+
+    recs = idx['records']
+    racy = set()
+    for rec in recs:
+        if 'mtime' not in rec:
+            continue
+        m = _mtime(_crumb_file(d, rec))
+        if m != rec['mtime']:
+            return None
+        if since - m < RACY:
+            racy.add(rec['entry'])
+    if racy:
+        recs = [r for r in recs if r['entry'] not in racy]
+        for entry in racy:
+            recs.extend(_probe(d, entry))
+        recs.sort(key=_order)
+    return recs
+
+
+def load(d):
+    # The cached records for `d`, or None if missing or stale.
+    if registry.exists(d):
+        return registry.load(d)
+    try:
+        with open(os.path.join(d, INDEX), 'r') as fp:
+            idx = json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(idx, dict) or idx.get('version') != VERSION:
+        return None
+    return _fresh(d, idx)
+
+
+def _save(d, idx):
+    # Written in place, so that an existing index file does not
+    # change the directory mtime it records.
+    if registry.exists(d):
+        return registry.save(d, idx)
+    # json.dumps() runs the C encoder, json.dump() does not
+    data = json.dumps(dict(idx, version=VERSION))
+    with open(os.path.join(d, INDEX), 'w') as fp:
+        fp.write(data)
+
+
+def rebuild(d):
+    # Scan `d` and write its index, for the commands that change it.
+    f = os.path.join(d, INDEX)
+    if not registry.exists(d) and not os.path.exists(f):
+        open(f, 'a').close()
+    # before the scan, so that a concurrent change is seen
+    mtime, since = _mtime(d), _now()
+    entries = _entries(d)
+    recs = _scan(d, entries)
+    _save(d, {'mtime': mtime, 'since': since, 'entries': entries,
+              'records': recs})
+    return recs
+
+
+def records(d):
+    # Records for `d`, from the index when it is fresh, otherwise from
+    # a scan that is not written back.
+    recs = load(d)
+    if recs is not None:
+        return recs
+    try:
+        return scan(d)
+    except OSError:
+        return []
+
+
+def _names(name):
+    return (name, name + '.py', name + '.zip')
+
+
+def find(d, name):
+    # Records of package `name` in `d`: an indexed query with a
+    # registry, otherwise a probe of the few entries it can be.
+    if registry.exists(d):
+        recs = registry.find(d, name=name)
+        if recs is not None:
+            return recs
+
+    recs = []
+    for entry in (name, name + '.py', name + '.zip', name + '.sitepath.pth',
+                  SHARED_PTH, FINDER_PTH):
+        if os.path.lexists(os.path.join(d, entry)):
+            recs.extend(r for r in _probe(d, entry)
+                        if r['kind'] != 'pth' and r['name'] in _names(name))
+    return recs
+
+
+def query(d, name=None, origin=None, kind=None):
+    # Records of `d` matching all of the given fields.
+    if registry.exists(d):
+        recs = registry.find(d, name, origin, kind)
+        if recs is not None:
+            return recs
+    return [r for r in records(d)
+            if (name is None or r['name'] in _names(name))
+            and (origin is None or (r.get('crumb') or {}).get('from') == origin)
+            and (kind is None or r['kind'] == kind)]
+
+
+_lock = threading.Lock()
+_active = {}    # directory -> number of edits in progress
+_dirty = set()  # directories edited concurrently
+
+
+class editing:
+    # Keep the index of `d` current across a change to `entries`.
+    #
+    #   with editing(sp, 'pkg'):
+    #       ...   # create or remove sp/pkg and its crumb
+    #
+    # A fresh index is patched, and a missing or stale one is rebuilt.
+    # Overlapping edits of the same directory within this process
+    # invalidate it instead, and the last of them to end rebuilds it.
+    # Within the batch of a Snapshot, the index is left to
+    # Snapshot.save().
+
+    def __init__(self, d, *entries, env=None):
+        self.d = str(d)
+        self.entries = entries
+        self.env = env      # a Snapshot to update as well
+        self.batched = isinstance(env, Snapshot)
+
+    def __enter__(self):
+        if self.batched:
+            return self
+        with _lock:
+            _active[self.d] = _active.get(self.d, 0) + 1
+            if _active[self.d] > 1:
+                _dirty.add(self.d)
+        # Entries that another process changes from here on may share
+        # the mtime of this edit, so the patched index is only trusted
+        # from this moment.
+        self.since = _now()
+        self.recs = load(self.d)
+        return self
+
+    def __exit__(self, *exc):
+        if self.batched:
+            self.env.refresh(self.d, self.entries, edited=True)
+            return
+        d = self.d
+        with _lock:
+            try:
+                if d in _dirty and _active[d] == 1:
+                    rebuild(d)
+                elif d in _dirty:
+                    self._invalidate()
+                elif exc[0] is None and self.recs is not None:
+                    self._patch()
+                elif exc[0] is None:
+                    rebuild(d)
+            except Exception:   # OSError, or sqlite3.Error
+                pass
+            finally:
+                _active[d] -= 1
+                if not _active[d]:
+                    del _active[d]
+                    _dirty.discard(d)
+        if self.env is not None:
+            # even after an error, the entries may have changed
+            self.env.refresh(d, self.entries)
+
+    def _invalidate(self):
+        if registry.exists(self.d) or \
+                os.path.exists(os.path.join(self.d, INDEX)):
+            _save(self.d, {'mtime': None, 'since': None, 'entries': None,
+                           'records': []})
+
+    def _patch(self):
+        entries = set(self.entries)
+        recs = [r for r in self.recs if r['entry'] not in entries]
+        for entry in entries:
+            recs.extend(_probe(self.d, entry))
+        recs.sort(key=_order)
+        mtime = _mtime(self.d)
+        _save(self.d, {'mtime': mtime, 'since': self.since,
+                       'entries': _entries(self.d), 'records': recs})
+
+
+def _placed(d, entry):
+    # The symlink or copy record of `entry`, or None. A crumb left
+    # without its package counts as a copy, so that it can be removed.
+    is_link = os.path.islink(os.path.join(d, entry))
+    for rec in _probe(d, entry, is_link):
+        return rec
+    return None
+
+
+class Probe:
+    # Answers the lookups of ops from the file system each time, for a
+    # single item. See Snapshot for a batch.
+
+    def __init__(self, top):
+        self.top = top
+
+    @property
+    def asp(self):
+        return self.top.asp
+
+    def exists(self, d, entry):
+        return os.path.lexists(os.path.join(d, entry))
+
+    def placed(self, d, entry):
+        return _placed(d, entry)
+
+    def find(self, d, name):
+        return find(d, name)
+
+    def refresh(self, d, entries):
+        pass
+
+
+class Snapshot:
+    # The site-packages list of `top`, and the entry names and records
+    # of each directory, read once for a batch of items. The directory
+    # listing and the index are read on the first lookup, and the ops
+    # keep both current through editing(..., env=snapshot). The index
+    # of each edited directory is written once, by save() at the end
+    # of the batch.
+
+    def __init__(self, top):
+        self.asp = top.asp
+        self._lock = threading.Lock()
+        self._sites = {}    # directory -> (entry names, name -> records)
+        self._edited = set()
+
+    def save(self):
+        with self._lock:
+            edited, self._edited = sorted(self._edited), set()
+        for d in edited:
+            try:
+                rebuild(d)
+            except Exception:   # OSError, or sqlite3.Error
+                pass
+
+    def _site(self, d):
+        with self._lock:
+            site = self._sites.get(d)
+            if site is None:
+                try:
+                    names = set(os.listdir(d))
+                except OSError:
+                    names = set()
+                by_name = {}
+                for rec in records(d):
+                    if rec['kind'] != 'pth':
+                        by_name.setdefault(rec['name'], []).append(rec)
+                site = self._sites[d] = (names, by_name)
+            return site
+
+    def exists(self, d, entry):
+        return entry in self._site(d)[0]
+
+    def placed(self, d, entry):
+        names, by_name = self._site(d)
+        for rec in by_name.get(entry, ()):
+            if rec['kind'] in ('symlink', 'copy', 'zip') and \
+                    rec['entry'] == entry:
+                return rec
+        if entry + '.sitepath' in names:
+            return _placed(d, entry)
+        return None
+
+    def find(self, d, name):
+        by_name = self._site(d)[1]
+        return [rec for n in _names(name) for rec in by_name.get(n, ())]
+
+    def refresh(self, d, entries, edited=False):
+        d = str(d)
+        with self._lock:
+            if edited:
+                self._edited.add(d)
+            if d not in self._sites:
+                return
+            names, by_name = self._sites[d]
+            entries = set(entries)
+            for n in list(by_name):
+                by_name[n] = [r for r in by_name[n] if r['entry'] not in entries]
+                if not by_name[n]:
+                    del by_name[n]
+            for entry in entries:
+                if os.path.lexists(os.path.join(d, entry)):
+                    names.add(entry)
+                else:
+                    names.discard(entry)
+                for rec in _probe(d, entry):
+                    if rec['kind'] != 'pth':
+                        by_name.setdefault(rec['name'], []).append(rec)
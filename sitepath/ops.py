@@ -19,9 +19,14 @@ import pathlib
 import sys
 import os
 import filecmp
+import time
+import threading
 
 from .crumb import *
 from .common import *
+from .ignore import IgnoreRules, copy_patterns, crumb_rules
+from . import index
+# copier, bytecode and archive are imported by the commands using them
 
 
 def _check_ident(p):
@@ -33,74 +38,71 @@ def _check_ident(p):
     return ident
 
 
+def _env(top, flags):
+    # the batch snapshot of the environment, or direct lookups
+    env = getattr(flags, 'snapshot', None)
+    return env if env is not None else index.Probe(top)
+
+
 def _link_copy(command, top, what, flags=None):
     stdout, stderr = top.stdout, top.stderr
 
     origin = top.abspath(what)   # origin path of the package.
     base = origin.name
     ident = _check_ident(origin)
+    zipped = ident + '.zip'
+    entries = [base]
+    if command == 'zip':
+        from . import archive
+        base = zipped
+        entries = [base, archive.pth_name(ident)]
 
     if not origin.exists():
         raise SitePathException('path not found: %r' % str(origin))
 
+    env = _env(top, flags)
     tried = []
-    for sp in top.asp:
+    for sp in env.asp:
         dst = pathlib.Path(sp, base)
 
-        if dst.exists():
-            if not has_crumb(dst):
+        # A package in site-packages hides an archive of the same name.
+        if command == 'zip' and env.exists(sp, origin.name):
+            raise SitePathException(
+                'Remove the package before zipping it: %r' % (
+                    os.path.join(sp, origin.name), ))
+        rec = env.placed(sp, zipped) if command != 'zip' else None
+        if rec is not None and rec['kind'] == 'zip':
+            done = {'copy': 'copied', 'symlink': 'symlinked'}[command]
+            raise SitePathException('Target was zipped, not %s: %r' % (
+                done, os.path.join(sp, zipped)))
+
+        if env.exists(sp, base):
+            rec = env.placed(sp, base)
+            if rec is None:
                 raise SitePathFailure(
                     'Existing package not created by sitepath: %r' % dst)
 
             # Ensure that the target is the correct type.
-            if command == 'symlink' and not dst.is_symlink():
+            if command == 'symlink' and rec['kind'] != 'symlink':
                 raise SitePathException(
                     'Target was copied, not symlinked: %r' % (str(dst), ))
 
-            elif command == 'copy' and dst.is_symlink():
+            elif command == 'copy' and rec['kind'] == 'symlink':
                 raise SitePathException(
                     'Target was symlinked, not copied: %r' % (str(dst), ))
 
-        # So far, if `dst` exists, it has a sitepath crumb, otherwise nothing is there.
-        if command == 'symlink':
-            cdir = '-->'
-            try:
-                if dst.exists():
-                    dst.unlink()
-                os.symlink(origin, dst, target_is_directory=True)
-                base = dst.name
-
-            except OSError as err:
-                tried.append(str(err))
-                continue
+            elif command == 'zip' and rec['kind'] != 'zip':
+                raise SitePathException(
+                    'Target was not zipped: %r' % (str(dst), ))
 
-        elif command == 'copy':
-            cdir = '<--'
-            try:
-                if origin.is_dir():
-                    shutil.rmtree(dst, ignore_errors=True)
-                    shutil.copytree(origin, dst)
-                elif origin.is_file():
-                    shutil.copy(origin, dst)
-                else:
-                    raise SitePathFailure(
-                        'Expecting a directory or file: %r' % str(origin))
-            except OSError as err:
-                tried.append(str(err))
-                continue
+        # So far, if `dst` exists, it has a sitepath crumb, otherwise nothing is there.
+        try:
+            with index.editing(sp, *entries, env=env):
+                cdir = _place(command, top, origin, dst, flags)
+        except OSError as err:
+            tried.append(str(err))
+            continue
 
-        else:
-            raise SitePathFailure('unrecognized command: %r' % command)
-
-        # Successfully completed command, now place the sitepath crumb.
-        place_crumb(dst,
-            {
-                'when':top.now,
-                'from':str(origin),
-                'how': command,
-                'base':base
-            }
-        )
         fprint(stdout, '%s: %r %s %r' % (command, str(dst), cdir, str(origin)))
         # TODO: warn if file/dir conflict
         break
@@ -111,12 +113,115 @@ def _link_copy(command, top, what, flags=None):
 
 
 
+def _place(command, top, origin, dst, flags=None):
+    # Create `dst` from `origin` and place its crumb. OSError means
+    # that this site-packages directory did not work out.
+    jobs = flags.jobs if flags else 1
+    cache = getattr(flags, 'cache', None)
+    extra = {}
+
+    if command == 'symlink':
+        cdir = '-->'
+        if dst.exists():
+            dst.unlink()
+        os.symlink(origin, dst, target_is_directory=True)
+
+    elif command == 'copy':
+        from .copier import sync_tree, sync_file, Backend
+        cdir = '<--'
+        backend = Backend(flags.backend if flags else 'auto')
+
+        # Only new or changed files are copied on a re-copy, unless
+        # switching to or from hardlinks, which share the origin's data.
+        manifest = None
+        reuse = True
+        if dst.exists():
+            manifest = get_manifest(dst)
+            c, cfile = get_crumb(dst)
+            was_linked = 'hardlink' in (c or {}).get('backend', '')
+            reuse = was_linked == (backend.name == 'hardlink')
+
+        with top.phase('sync', str(origin)):
+            if origin.is_dir():
+                patterns = copy_patterns(origin, getattr(flags, 'exclude', ()))
+                r = sync_tree(origin, dst, jobs, manifest, backend, reuse,
+                              cache, IgnoreRules(patterns),
+                              bytecode=bool(getattr(flags, 'compile', None)))
+                extra['exclude'] = patterns
+            elif origin.is_file():
+                r = sync_file(origin, dst, manifest, backend, reuse, cache)
+            else:
+                raise SitePathFailure(
+                    'Expecting a directory or file: %r' % str(origin))
+        with top.phase('manifest'):
+            place_manifest(dst, r.manifest)
+        extra['backend'] = backend.describe()
+
+    elif command == 'zip':
+        from . import archive
+        cdir = '<=='
+        rules = None
+        if origin.is_dir():
+            patterns = copy_patterns(origin, getattr(flags, 'exclude', ()))
+            rules = IgnoreRules(patterns)
+            extra['exclude'] = patterns
+
+        # zipimport only looks for <module>.pyc, so one level is kept
+        levels = getattr(flags, 'compile', None)
+        level = levels[0] if levels else None
+        with top.phase('zip', str(origin)):
+            manifest, failed = archive.build(origin, dst, rules, level)
+        if failed:
+            fprint(top.stderr, 'note: not every file compiled: %r' % str(dst))
+        if level is not None:
+            extra['compiled'] = [level]
+        with top.phase('manifest'):
+            place_manifest(dst, manifest)
+
+        pth_file = archive.pth_name(_check_ident(origin))
+        with open(os.path.join(str(dst.parent), pth_file), 'w') as fp:
+            print(dst.name, file=fp)
+        st = os.stat(str(dst))
+        extra['pth_file'] = pth_file
+        extra['archive'] = [st.st_size, st.st_mtime_ns]
+
+    else:
+        raise SitePathFailure('unrecognized command: %r' % command)
+
+    levels = getattr(flags, 'compile', None)
+    if levels and command != 'zip':
+        _compile(top, dst, levels, jobs)
+        extra['compiled'] = levels
+
+    # Successfully completed command, now place the sitepath crumb.
+    crumb = {
+        'when':top.now,
+        'from':str(origin),
+        'how': command,
+        'base':dst.name
+    }
+    crumb.update(extra)
+    with top.phase('crumb'):
+        place_crumb(dst, crumb)
+    return cdir
+
+
+def _compile(top, p, levels, jobs):
+    from . import bytecode
+    with top.phase('compile', str(p)):
+        if not bytecode.compile_path(p, levels, jobs):
+            fprint(top.stderr, 'note: not every file compiled: %r' % str(p))
+
+
 def symlink(top, what, flags=None):
     return _link_copy('symlink', top, what, flags)
 
 def copy(top, what, flags=None):
     return _link_copy('copy', top, what, flags)
 
+def zip(top, what, flags=None):   # the builtin is not used here
+    return _link_copy('zip', top, what, flags)
+
 
 def _uncommand(top, what):
     # helper for unlink/uncopy/undevelop
@@ -146,21 +251,27 @@ def _unlink_uncopy(command, top, what, flags=None):
 
     ident = uflags.ident
 
+    env = _env(top, flags)
     tried = []
-    for sp in top.asp:
+    for sp in env.asp:
         p = str(pathlib.Path(sp, ident))
 
-        # Check for possible crumbs.
-        if not has_crumb(p):  # directory crumb
-            if has_crumb(p + '.py'):   # file crumb
-                p = p + '.py'
-            else:
+        # Check for possible crumbs, directory then file.
+        if command == 'unzip':
+            rec = env.placed(sp, ident + '.zip')
+            if rec is None:
+                tried.append(p + '.zip.sitepath')
+                continue
+        else:
+            rec = env.placed(sp, ident) or env.placed(sp, ident + '.py')
+            if rec is None:
                 tried.append(p + '.sitepath')
                 tried.append(p + '.py.sitepath')
                 continue
+        p = os.path.join(sp, rec['entry'])
 
-        # Open the crumb, get the undo data.
-        c, cfile = get_crumb(p)
+        # The crumb holds the undo data.
+        c = rec['crumb']
         base = c['base']
 
         if uflags.needs_origin:
@@ -171,28 +282,44 @@ def _unlink_uncopy(command, top, what, flags=None):
 
         target = os.path.join(sp, base)
         tried.append(target)
+        entries = [base]
+        if command == 'unzip':
+            from . import archive
+            pth_file = c.get('pth_file', archive.pth_name(ident))
+            entries.append(pth_file)
+
+        with index.editing(sp, *entries, env=env):
+            if command == 'unsymlink':
+                if os.path.islink(target):
+                    rlink = os.readlink(target) # TODO: sanity check the link
+                    os.remove(target)
+                else:
+                    raise SitePathFailure('Path is not a symlink: %r' % p)
 
-        if command == 'unsymlink':
-            if os.path.islink(target):
-                rlink = os.readlink(target) # TODO: sanity check the link
-                os.remove(target)
-            else:
-                raise SitePathFailure('Path is not a symlink: %r' % p)
-
-        elif command == 'uncopy':
-            if os.path.isdir(target):
-                shutil.rmtree(target)
-            elif os.path.isfile(target):
-                os.remove(target)
+            elif command == 'uncopy':
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                elif os.path.isfile(target):
+                    os.remove(target)
+                else:
+                    if os.path.exists(target):
+                        raise SitePathFailure('not a directory or file: %r' % target)
+
+            elif command == 'unzip':
+                if rec['kind'] != 'zip':
+                    raise SitePathFailure('Path is not a zip archive: %r' % p)
+                pth = os.path.join(sp, pth_file)
+                if os.path.exists(pth):
+                    os.remove(pth)   # off sys.path first
+                if os.path.isfile(target):
+                    os.remove(target)
             else:
-                if os.path.exists(target):
-                    raise SitePathFailure('not a directory or file: %r' % target)
-        else:
-            raise SitePathFailure('unrecongnized command: %r' % command)
+                raise SitePathFailure('unrecongnized command: %r' % command)
 
 
-        fprint(stdout, 'deleted crumb:', c)
-        remove_crumb(target)
+            fprint(stdout, 'deleted crumb:', c)
+            remove_crumb(target)
+            remove_manifest(target)
         fprint(stdout, '%s: %r' % (command, target))
         break
 
@@ -210,6 +337,79 @@ def unsymlink(top, what, flags=None):
     return _unlink_uncopy('unsymlink', top, what, flags)
 
 
+def unzip(top, what, flags=None):
+    return _unlink_uncopy('unzip', top, what, flags)
+
+
+class _shared_pth:
+    # Edit a consolidated .pth file of `sp` as a transaction:
+    #
+    #   with _shared_pth(sp) as sh:
+    #       sh.crumbs[name] = crumb
+    #
+    # Other threads wait on a lock, other processes on flock() of the
+    # directory where available. The file is replaced in one rename.
+    # The finder file also keeps the finder module next to it.
+
+    _lock = threading.Lock()
+
+    def __init__(self, sp, name=SHARED_PTH):
+        self.sp = str(sp)
+        self.path = os.path.join(self.sp, name)
+        self.finder = (name == FINDER_PTH)
+        self.fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            try:
+                import fcntl
+                self.fd = os.open(self.sp, os.O_RDONLY)
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            except (ImportError, OSError):
+                pass
+            self.crumbs = get_shared_pth(self.path) or {}
+        except BaseException:
+            self._release()
+            raise
+        self.before = {k: dict(v) for k, v in self.crumbs.items()}
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if exc[0] is None and self.crumbs != self.before:
+                if self.finder:
+                    _place_finder(self.sp, bool(self.crumbs))
+                place_shared_pth(self.path, self.crumbs, self.finder)
+        finally:
+            self._release()
+
+    def _release(self):
+        if self.fd is not None:
+            os.close(self.fd)   # also drops the flock
+            self.fd = None
+        self._lock.release()
+
+
+def _in_shared_pth(env, sp, name, pth=SHARED_PTH):
+    return any(rec['kind'] == 'develop' and rec['entry'] == pth
+               for rec in env.find(sp, name))
+
+
+def _place_finder(sp, needed):
+    # Copy finder.py to site-packages for sitepath-finder.pth to import,
+    # or remove it with the last package.
+    dst = os.path.join(sp, FINDER_MODULE + '.py')
+    if not needed:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return
+    src = os.path.join(os.path.dirname(__file__), 'finder.py')
+    tmp = dst + '.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
 def develop(top, what, flags=None):
     stdout, stderr = top.stdout, top.stderr
 
@@ -222,19 +422,49 @@ def develop(top, what, flags=None):
     devpath, filename = os.path.split(p)
     pth_file = '%s.sitepath.pth' % package
 
+    crumb = {
+        'when':top.now,
+        'from':str(p),
+        'how':'develop',
+        'base':package
+    }
+    levels = getattr(flags, 'compile', None)
+    if levels:
+        _compile(top, p, levels, flags.jobs)
+        crumb['compiled'] = levels
+
+    finder = getattr(flags, 'finder', False)
+    shared = getattr(flags, 'shared_pth', False)
+
+    env = _env(top, flags)
     tried = []
-    for sp in top.asp:
+    for sp in env.asp:
         pth = os.path.join(sp, pth_file)
         try:
-            with open(pth, 'w') as fp:
-                js = json.dumps(
-                    {
-                        'when':top.now,
-                        'from':str(p),
-                        'how':'develop',
-                        'base':package
-                    }
-                )
+            # a package stays where it is, unless told otherwise
+            if finder or (not shared and
+                          _in_shared_pth(env, sp, package, FINDER_PTH)):
+                target, other = FINDER_PTH, SHARED_PTH
+            elif shared or _in_shared_pth(env, sp, package):
+                target, other = SHARED_PTH, FINDER_PTH
+            else:
+                target = None
+
+            if target is not None:
+                with index.editing(sp, target, other, pth_file, env=env):
+                    with _shared_pth(sp, target) as sh:
+                        sh.crumbs[package] = crumb
+                    # moved from one of the other files
+                    if os.path.exists(pth):
+                        os.remove(pth)
+                    with _shared_pth(sp, other) as sh2:
+                        sh2.crumbs.pop(package, None)
+                dest = p if target == FINDER_PTH else devpath
+                fprint(stdout, 'develop: %r >>> %r' % (sh.path, str(dest)))
+                break
+
+            with index.editing(sp, pth_file, env=env), open(pth, 'w') as fp:
+                js = json.dumps(crumb)
                 print('# sitepath: %s' % js, file=fp)
                 print(devpath, file=fp)
 
@@ -255,17 +485,32 @@ def undevelop(top, what, flags=None):
 
     ident = uflags.ident
 
+    env = _env(top, flags)
     tried = []
-    for sp in top.asp:
+    for sp in env.asp:
         pth_file = '%s.sitepath.pth' % ident
 
         p = os.path.join(sp, pth_file)
 
         tried.append(p)
-        if os.path.exists(p):
-            os.remove(p)
+        if env.exists(sp, pth_file):
+            with index.editing(sp, pth_file, env=env):
+                os.remove(p)
             fprint(stdout, 'undevelop: %r' % (p, ))
             break
+
+        for name in (SHARED_PTH, FINDER_PTH):
+            shared = os.path.join(sp, name)
+            tried.append(shared)
+            if _in_shared_pth(env, sp, ident, name):
+                with index.editing(sp, name, env=env), \
+                        _shared_pth(sp, name) as sh:
+                    sh.crumbs.pop(ident, None)
+                fprint(stdout, 'undevelop: %r from %r' % (ident, shared))
+                break
+        else:
+            continue
+        break
     else:
         head, tail = os.path.split(p)
         raise SitePathFailure(
@@ -273,53 +518,104 @@ def undevelop(top, what, flags=None):
                 pth_file, '\n    '.join(tried)))
 
 
+def _record(kind, path, name, site, crumb):
+    # A machine-readable description of one sitepath-managed package.
+    crumb = crumb or {}
+    origin = crumb.get('from')
+    rec = {
+        'type': 'package',
+        'kind': kind,
+        'name': name,
+        'path': str(path),
+        'site': str(site),
+        'origin': origin,
+        'crumb': crumb,
+        'status': 'ok',
+    }
+    if kind == 'symlink':
+        try:
+            rec['target'] = os.readlink(str(path))
+        except OSError:
+            rec['target'] = None
+        if rec['target'] is None or not os.path.exists(str(path)):
+            rec['status'] = 'broken'
+    elif origin is None or not os.path.exists(origin):
+        rec['status'] = 'missing'
+    elif kind == 'develop' and len(crumb.get('pth', [])) != 1:
+        # the file has been modified outside sitepath
+        rec['status'] = 'modified'
+    return rec
+
+
+def _info_found(recs):
+    # The symlink or copy, then the develop, of one package in one
+    # site-packages directory, as (kind, entry, crumb).
+    found = []
+    for kinds in (('symlink', 'copy', 'zip'), ('develop',)):
+        for rec in recs:
+            if rec['kind'] in kinds and rec.get('crumb') is not None:
+                found.append((rec['kind'], rec['entry'], rec['crumb']))
+                break
+    return found
+
+
+def _show_info(top, flags, uflags, ident, sp, kind, entry, d):
+    stdout = top.stdout
+    path = os.path.join(sp, entry)
+    dfile = path if kind == 'develop' else path + '.sitepath'
+
+    out = flags.out if flags else None
+    if out is not None:
+        rec = _record(kind, path, ident, sp, d)
+        rec['crumb_file'] = dfile
+        if uflags.needs_origin and d.get('from') != uflags.origin:
+            rec['mismatched'] = uflags.origin
+        out.emit(rec)
+        return
+
+    kvf = '%10s: %s'  # formatting string
+    fprint(stdout, '%s:' % ident)
+    fprint(stdout, kvf % ('crumb', dfile))
+    for key in sorted(d, reverse=True):
+        value = d[key]
+
+        s = []
+        if key == 'from':
+            if not os.path.exists(value):
+                if 'link' in d.get('how', ''):
+                    s.append('(broken)')
+                else:
+                    s.append('(missing)')
+            if uflags.needs_origin:
+                if value != uflags.origin:
+                    s.append('(mismatched to %r)' % uflags.origin)
+        if s:
+            value = value + ' # ' + ' '.join(s)
+
+        fprint(stdout,  kvf % (key, repr(value)))
+
+
 def info(top, what, flags=None):
     # print out the crumb contents
-    stdout, stderr = top.stdout, top.stderr
     uflags = _uncommand(top, what)
     ident = uflags.ident
 
     if flags and flags.path_to_name:
         uflags.needs_origin = False
 
+    env = _env(top, flags)
     tried = []
-    for sp in top.asp:
-        base = os.path.join(sp, ident)
-
-        c, cfile = get_crumb(base)
-        p, pfile = get_pth(base + '.sitepath.pth')
-
-        if c is None and p is None:
-            tried.append(cfile)
-            tried.append(pfile)
+    for sp in env.asp:
+        found = _info_found(env.find(sp, ident))
+        if not found:
+            tried.append(os.path.join(sp, ident + '.sitepath'))
+            tried.append(os.path.join(sp, ident + '.sitepath.pth'))
             continue
 
         # It is possible to have a developed and linked/copied package.
         # I'm not going to stop you.
-        for d, dfile in [(c, cfile), (p, pfile)]:
-            if d is None:
-                continue
-
-            kvf = '%10s: %s'  # formatting string
-            fprint(stdout, '%s:' % ident)
-            fprint(stdout, kvf % ('crumb', dfile))
-            for key in sorted(d, reverse=True):
-                value = d[key]
-
-                s = []
-                if key == 'from':
-                    if not os.path.exists(value):
-                        if 'link' in d.get('how', ''):
-                            s.append('(broken)')
-                        else:
-                            s.append('(missing)')
-                    if uflags.needs_origin:
-                        if value != uflags.origin:
-                            s.append('(mismatched to %r)' % uflags.origin)
-                if s:
-                    value = value + ' # ' + ' '.join(s)
-
-                fprint(stdout,  kvf % (key, repr(value)))
+        for kind, entry, d in found:
+            _show_info(top, flags, uflags, ident, sp, kind, entry, d)
         break
     else:
         raise SitePathFailure(
@@ -327,7 +623,46 @@ def info(top, what, flags=None):
                 ident, '\n    '.join(tried)))
 
 
-def _compare_crumb(p):
+def info_all(top, flags=None):
+    # `info` of every package, from one index read per site-packages
+    # directory. Like `info <name>`, only the first directory that
+    # has a package is shown.
+    found = {}   # name -> (site-packages, records)
+    for sp in top.asp:
+        for rec in index.records(sp):
+            if rec['kind'] == 'pth':
+                continue
+            ident = os.path.splitext(rec['name'])[0]
+            site, recs = found.setdefault(ident, (sp, []))
+            if site == sp:
+                recs.append(rec)
+
+    uflags = result(ident=None, needs_origin=False, origin='')
+    for ident in sorted(found):
+        sp, recs = found[ident]
+        for kind, entry, d in _info_found(recs):
+            _show_info(top, flags, uflags, ident, sp, kind, entry, d)
+
+
+def _tree_changed(src, origin, rules):
+    # Whether the files of `src` and `origin` differ, byte by byte.
+    # Files matching `rules` are left out on both sides.
+    from .copier import scan_tree
+    _, src_files = scan_tree(src, rules)
+    _, origin_files = scan_tree(origin, rules)
+    if set(src_files) != set(origin_files):
+        return True
+    match, mismatch, errors = filecmp.cmpfiles(
+        src, origin, sorted(src_files), shallow=False)
+    return bool(mismatch or errors)
+
+
+def _compare_crumb(p, deep=False):
+    # With a manifest, only the origin is read, the installed copy is
+    # not touched. `deep` compares the installed copy with the origin
+    # byte by byte instead, or for hardlinks, which share the origin's
+    # data, stats it against the manifest.
+    from .copier import manifest_diff
     c, cfile = get_crumb(p)
     origin = c.get('from')
     base = c.get('base')
@@ -340,19 +675,88 @@ def _compare_crumb(p):
     if not os.path.exists(src):
         raise SitePathFailure('package for crumb missing: %r' % src)
 
+    installed = deep
+    if 'hardlink' in c.get('backend', ''):
+        deep = False   # the copy shares its data with the origin
+
+    rules = crumb_rules(c)
+
     changed = False
-    if os.path.isfile(src) and os.path.isfile(origin):
+    manifest = None if deep else get_manifest(src)
+    if c.get('how') == 'zip':
+        changed = _zip_changed(src, origin, c, manifest, rules)
+    elif manifest is not None:
+        diff = manifest_diff(origin, src if installed else None,
+                             manifest, rules)
+        if diff:
+            changed = True
+    elif os.path.isfile(src) and os.path.isfile(origin):
         if not filecmp.cmp(src, origin, shallow=False):
             changed = True
     elif os.path.isdir(src) and os.path.isdir(origin):
-        dcmp = filecmp.dircmp(src, origin)
-        x = []
-        for attr in ['left_only', 'right_only', 'diff_files']:
-            x.extend(getattr(dcmp, attr))
-        if x:
+        if _tree_changed(src, origin, rules):
             changed = True
 
     else:
         changed = True
 
+    # bytecode written by --compile that no longer matches the source
+    levels = c.get('compiled')
+    stale = []
+    if levels:
+        from . import bytecode
+        stale = bytecode.stale(src, levels)
+
     return result(locals())
+
+
+def _zip_changed(p, origin, c, manifest, rules):
+    # An archive differs when it was modified after it was built, or
+    # when its origin moved on. Without a manifest, and for --deep, the
+    # origin files are compared with the archive members.
+    from .copier import manifest_diff
+    if manifest is None:
+        from . import archive
+        return archive.changed(p, origin, rules)
+    st = os.stat(p)
+    if c.get('archive') != [st.st_size, st.st_mtime_ns]:
+        return True
+    return bool(manifest_diff(origin, None, manifest, rules))
+
+
+def _stale_linked(kind, p, crumb):
+    # Stale bytecode of a symlinked or developed --compile package.
+    from . import bytecode
+    levels = (crumb or {}).get('compiled')
+    target = str(p) if kind == 'symlink' else crumb.get('from')
+    if not levels or target is None or not os.path.exists(target):
+        return []
+    return bytecode.stale(target, levels)
+
+
+def _timed_compare(p, deep, observer=None):
+    t0 = time.perf_counter()
+    with phase(observer, 'compare', p):
+        try:
+            cr = _compare_crumb(p, deep)
+        except SitePathFailure as f:
+            cr = f
+    return p, cr, time.perf_counter() - t0
+
+
+def _compare_crumbs(paths, deep=False, jobs=1, ordered=False, observer=None):
+    # Yield (path, result or SitePathFailure, seconds) for each crumb.
+    # With jobs > 1, results stream in completion order unless `ordered`.
+    if jobs <= 1:
+        for p in paths:
+            yield _timed_compare(p, deep, observer)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_timed_compare, p, deep, observer)
+                   for p in paths]
+        if not ordered:
+            futures = as_completed(futures)
+        for f in futures:
+            yield f.result()
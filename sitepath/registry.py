@@ -0,0 +1,188 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# An optional SQLite registry of the sitepath-managed entries of one
+# site-packages directory, created by `sitepath registry init`. When
+# present, it takes the place of the JSON index (see index.py) and
+# answers lookups by name, origin and kind with an indexed query. The
+# crumb files stay the source of truth, the registry is rebuilt from
+# them when stale.
+
+import os
+import json
+
+REGISTRY = '.sitepath-registry.sqlite'
+VERSION = 1
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS packages (
+    seq INTEGER PRIMARY KEY,
+    entry TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    origin TEXT,
+    mtime INTEGER,
+    crumb TEXT
+);
+CREATE INDEX IF NOT EXISTS packages_name ON packages (name);
+CREATE INDEX IF NOT EXISTS packages_origin ON packages (origin);
+CREATE INDEX IF NOT EXISTS packages_kind ON packages (kind);
+'''
+
+_COLUMNS = 'entry, kind, name, mtime, crumb'
+
+
+def path(d):
+    return os.path.join(str(d), REGISTRY)
+
+
+def exists(d):
+    return os.path.isfile(path(d))
+
+
+def _connect(d):
+    import sqlite3
+    db = sqlite3.connect(path(d), timeout=30)
+    # No journal file, so that writing the registry leaves the mtime
+    # of site-packages alone. It can always be rebuilt from the crumbs.
+    db.execute('PRAGMA journal_mode=MEMORY')
+    return db
+
+
+def create(d):
+    db = _connect(d)
+    try:
+        with db:
+            db.executescript(_SCHEMA)
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                       ('version', VERSION))
+    finally:
+        db.close()
+
+
+def drop(d):
+    if exists(d):
+        os.remove(path(d))
+
+
+def _rows_to_records(rows):
+    recs = []
+    for entry, kind, name, mtime, crumb in rows:
+        rec = {'kind': kind, 'entry': entry, 'name': name}
+        if mtime is not None:
+            rec['mtime'] = mtime
+        if crumb is not None:
+            rec['crumb'] = json.loads(crumb)
+        elif kind != 'pth':
+            rec['crumb'] = None
+        recs.append(rec)
+    return recs
+
+
+def _meta(db, key):
+    row = db.execute('SELECT value FROM meta WHERE key = ?',
+                     (key,)).fetchone()
+    return None if row is None else row[0]
+
+
+def _query(d, where='', args=(), keep=None):
+    # Matching records, or None when the registry is stale. Records
+    # read again by the freshness check are filtered with `keep`.
+    from .index import _fresh
+    d = str(d)
+    try:
+        db = _connect(d)
+    except Exception:
+        return None
+    try:
+        if _meta(db, 'version') != VERSION:
+            return None
+        recs = _rows_to_records(db.execute(
+            'SELECT %s FROM packages %s ORDER BY seq' % (_COLUMNS, where),
+            args).fetchall())
+        entries = _meta(db, 'entries')
+        recs = _fresh(d, {
+            'mtime': _meta(db, 'mtime'), 'since': _meta(db, 'since'),
+            'entries': None if entries is None else json.loads(entries),
+            'records': recs})
+        if recs is None or keep is None:
+            return recs
+        return [rec for rec in recs if keep(rec)]
+    except Exception:
+        return None
+    finally:
+        db.close()
+
+
+def load(d):
+    # All records of `d`, or None if stale.
+    return _query(d)
+
+
+def find(d, name=None, origin=None, kind=None):
+    # Records matching all of the given fields, or None if stale. A
+    # name also matches a single-file package or an archive, 'mod' finds
+    # 'mod.py' and 'mod.zip'.
+    where = []
+    args = []
+    if name is not None:
+        where.append('name IN (?, ?, ?)')
+        args.extend([name, name + '.py', name + '.zip'])
+    if origin is not None:
+        where.append('origin = ?')
+        args.append(origin)
+    if kind is not None:
+        where.append('kind = ?')
+        args.append(kind)
+    if not where:
+        return _query(d)
+
+    def keep(rec):
+        return ((name is None or
+                 rec['name'] in (name, name + '.py', name + '.zip')) and
+                (origin is None or
+                 (rec.get('crumb') or {}).get('from') == origin) and
+                (kind is None or rec['kind'] == kind))
+    return _query(d, 'WHERE ' + ' AND '.join(where), args, keep)
+
+
+def save(d, idx):
+    # Replace the records with those of the index `idx`, see index.py.
+    recs = idx['records']
+    entries = idx['entries']
+    db = _connect(d)
+    try:
+        with db:
+            db.executescript(_SCHEMA)
+            db.execute('DELETE FROM packages')
+            db.executemany(
+                'INSERT INTO packages (entry, kind, name, origin, mtime, crumb)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                [(rec['entry'], rec['kind'], rec['name'],
+                  (rec.get('crumb') or {}).get('from'), rec.get('mtime'),
+                  None if rec.get('crumb') is None else json.dumps(rec['crumb']))
+                 for rec in recs])
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                       ('version', VERSION))
+            for key in ('mtime', 'since'):
+                db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                           (key, idx[key]))
+            db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                       ('entries', None if entries is None
+                        else json.dumps(entries)))
+    finally:
+        db.close()
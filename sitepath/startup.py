@@ -0,0 +1,207 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# `startup-cost`: what the sitepath-managed entries cost the target
+# interpreter. The interpreter is started with -S and runs site.main()
+# itself, so that .pth files can be timed one by one or skipped
+# without touching site-packages.
+
+import os
+import json
+import time
+import subprocess
+
+from .common import *
+
+# Run by the target interpreter. argv[1] is a JSON object with
+# 'skip': .pth paths to leave out, 'imports': modules to import, and
+# 'probe': lookups per extra sys.path directory.
+_DRIVER = '''if 1:
+    import os, sys, json, time, site
+    import importlib.machinery
+    cfg = json.loads(sys.argv[1])
+    skip = set(cfg['skip'])
+    pth = {}
+    addpackage = site.addpackage
+    def timed(sitedir, name, known_paths):
+        p = os.path.join(sitedir, name)
+        if p in skip:
+            return known_paths
+        before = set(sys.path)
+        t = time.perf_counter()
+        r = addpackage(sitedir, name, known_paths)
+        # a venv can have site.main() read the same directory twice
+        e = pth.setdefault(p, [0.0, []])
+        e[0] += time.perf_counter() - t
+        e[1].extend(d for d in sys.path if d not in before)
+        return r
+    site.addpackage = timed
+    site.main()
+
+    imports = {}
+    for name in cfg['imports']:
+        try:
+            __import__(name)
+            imports[name] = True
+        except BaseException:
+            imports[name] = False
+
+    probe = {}
+    n = cfg['probe']
+    for p, (seconds, dirs) in pth.items():
+        for d in dirs if n else ():
+            t = time.perf_counter()
+            for i in range(n):
+                importlib.machinery.PathFinder.find_spec(
+                    '_sitepath_missing_%i' % i, [d])
+            probe[d] = (time.perf_counter() - t) / n
+    print(json.dumps({'pth': pth, 'imports': imports, 'probe': probe}))
+'''
+
+
+def _run(python, skip=(), imports=(), probe=0, importtime=False):
+    # (wall seconds, driver report, {module: cumulative import seconds})
+    args = [python, '-S']
+    if importtime:
+        args.extend(['-X', 'importtime'])
+    cfg = json.dumps({'skip': list(skip), 'imports': list(imports),
+                      'probe': probe})
+    t0 = time.perf_counter()
+    try:
+        proc = subprocess.run(args + ['-c', _DRIVER, cfg],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+    except OSError as err:
+        raise SitePathFailure('Unable to run %r: %s' % (python, err))
+    wall = time.perf_counter() - t0
+    if proc.returncode:
+        raise SitePathFailure('Unable to measure %r:\n%s' % (
+            python, proc.stderr.strip()))
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if line.startswith('import time:') and line.count('|') == 2:
+            _, cumulative, name = line.split('|')
+            name = name.strip()
+            if cumulative.strip().isdigit() and name not in times:
+                times[name] = int(cumulative) / 1e6
+    return wall, json.loads(proc.stdout), times
+
+
+def _best(runs, get):
+    values = [get(r) for r in runs]
+    values = [v for v in values if v is not None]
+    return min(values) if values else None
+
+
+def _pth_file(e):
+    # The .pth file that puts the status record `e` on sys.path, if any.
+    if e.kind == 'develop':
+        return str(e.path)
+    if e.kind == 'zip':
+        from . import archive
+        c = e.crumb if isinstance(e.crumb, dict) else {}
+        ident = os.path.splitext(e.name)[0]
+        return os.path.join(str(e.site),
+                            c.get('pth_file', archive.pth_name(ident)))
+    return None
+
+
+def measure(python, entries, repeat=5, probe=200):
+    # `entries` are the _iter_status() records of the target. Returns
+    # the startup times with and without the sitepath .pth files, and
+    # a cost record per entry and per extra sys.path directory.
+    pths = sorted({p for p in map(_pth_file, entries) if p is not None})
+    names = []
+    for e in entries:
+        name = e.name
+        if e.kind in ('symlink', 'copy', 'zip'):
+            name = os.path.splitext(name)[0]   # mod.py, pkg.zip
+        if name.isidentifier() and name not in names:
+            names.append(name)
+
+    with_ = [_run(python)[0] for i in range(repeat)]
+    without = [_run(python, skip=pths)[0] for i in range(repeat)]
+    runs = [_run(python, imports=names, probe=probe, importtime=True)
+            for i in range(repeat)]
+
+    costs = []
+    dirs = {}
+    for e in entries:
+        path = str(e.path)
+        name = e.name
+        if e.kind in ('symlink', 'copy', 'zip'):
+            name = os.path.splitext(name)[0]
+        rec = {'type': 'cost', 'kind': e.kind, 'name': e.name, 'path': path,
+               'pth_ms': None, 'sys_path': [], 'imported': None,
+               'import_ms': None}
+        pth = _pth_file(e)
+        if pth is not None:
+            rec['pth_ms'] = _best(runs, lambda r: r[1]['pth'].get(
+                pth, [None])[0])
+            rec['sys_path'] = runs[0][1]['pth'].get(pth, [0, []])[1]
+            for d in rec['sys_path']:
+                dirs.setdefault(d, pth)
+        rec['imported'] = runs[0][1]['imports'].get(name)
+        rec['import_ms'] = _best(runs, lambda r: r[2].get(name))
+        for key in ('pth_ms', 'import_ms'):
+            if rec[key] is not None:
+                rec[key] *= 1000
+        costs.append(rec)
+
+    for d, path in sorted(dirs.items()):
+        us = _best(runs, lambda r: r[1]['probe'].get(d))
+        costs.append({'type': 'sys_path', 'dir': d, 'pth': path,
+                      'miss_us': None if us is None else us * 1e6})
+
+    return result(python=python, with_ms=min(with_) * 1000,
+                  without_ms=min(without) * 1000, costs=costs,
+                  repeat=repeat)
+
+
+def report(top, r, out=None):
+    if out is not None:
+        out.emit({'type': 'startup', 'python': r.python, 'repeat': r.repeat,
+                  'with_ms': r.with_ms, 'without_ms': r.without_ms})
+        for rec in r.costs:
+            out.emit(rec)
+        out.close()
+        return
+
+    ms = lambda x: '-' if x is None else '%.3f' % x
+    stdout = top.stdout
+    fprint(stdout, '# startup-cost: %s (best of %i)' % (r.python, r.repeat))
+    fprint(stdout, '# startup: %.1f ms, %.1f ms without sitepath .pth files '
+                   '(%+.1f ms)' % (r.with_ms, r.without_ms,
+                                   r.with_ms - r.without_ms))
+    fprint(stdout, '# %-8s %9s %9s  %s' % ('kind', 'pth ms', 'import ms',
+                                           'entry'))
+    for rec in r.costs:
+        if rec['type'] == 'cost':
+            note = ''
+            if rec['imported'] is False:
+                note = '  (import failed)'
+            fprint(stdout, '  %-8s %9s %9s  %s%s' % (
+                rec['kind'], ms(rec['pth_ms']), ms(rec['import_ms']),
+                rec['path'], note))
+            for d in rec['sys_path']:
+                fprint(stdout, '  %-8s %9s %9s    + sys.path %s' % (
+                    '', '', '', d))
+    dirs = [rec for rec in r.costs if rec['type'] == 'sys_path']
+    if dirs:
+        fprint(stdout, '# extra sys.path directories, cost per import lookup:')
+        for rec in dirs:
+            fprint(stdout, '  %9s us  %s' % (ms(rec['miss_us']), rec['dir']))
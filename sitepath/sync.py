@@ -0,0 +1,207 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# `sync <manifest>`: converge the environment to a list of packages and
+# how each one is placed. Packages that are already placed as listed
+# are left alone, changed copies are re-copied, and everything else is
+# added, replaced or removed.
+#
+#   # <mode> <path>
+#   copy     ~/src/pkg
+#   develop  ~/src/tool
+#   symlink  ./vendored/mod.py
+#   zip      ~/src/lib
+
+import os
+
+from .common import *
+from . import core
+
+MODES = ('symlink', 'copy', 'develop', 'zip')
+UNDO = {'symlink': 'unsymlink', 'copy': 'uncopy', 'develop': 'undevelop',
+        'zip': 'unzip'}
+
+
+def read_manifest(top, file):
+    # [(mode, origin)] of the manifest, skipping blanks and comments
+    p = top.abspath(file)
+    try:
+        with open(str(p), 'r') as fp:
+            lines = [line.strip() for line in fp]
+    except OSError:
+        raise SitePathException('File not found %r' % str(p))
+
+    wanted = []
+    names = {}
+    for n, line in enumerate(lines, 1):
+        if not line or line[0] == '#':
+            continue
+        mode, path = (line.split(None, 1) + [''])[:2]
+        if mode not in MODES or not path:
+            raise SitePathException(
+                'Expecting "<mode> <path>" with a mode of %s, line %i: %r' % (
+                    ', '.join(MODES), n, line))
+        origin = str(top.abspath(path))
+        name = _name(origin)
+        if name in names:
+            raise SitePathException('Package %r listed twice, line %i' % (
+                name, n))
+        names[name] = n
+        wanted.append((mode, origin))
+    return wanted
+
+
+def _name(origin):
+    return os.path.splitext(os.path.basename(origin.rstrip(os.sep)))[0]
+
+
+def _current(top):
+    # package name -> [(kind, origin, path)] of what is placed now
+    st = core._get_status(top)
+    placed = [(p, 'develop', c) for p, c in zip(st.dev, st.dev_crumbs)]
+    placed.extend((p, 'symlink', st.crumbs[p]) for p in st.syms)
+    placed.extend((p, 'copy', st.crumbs[p]) for p in st.copies)
+    placed.extend((p, 'zip', st.crumbs[p]) for p in st.zips)
+
+    current = {}
+    for path, kind, crumb in placed:
+        origin = (crumb or {}).get('from')
+        if origin is None:
+            continue    # unreadable crumb, left alone
+        current.setdefault(_name(origin), []).append((kind, origin, path))
+    return current
+
+
+def _copy_bytes(origin, dst, exclude, kind='copy'):
+    # (whether anything changed, bytes to write) for a copy of `origin`:
+    # every file it copies, or only the new and changed ones with a copy
+    # at `dst`. A zip archive is written whole when anything changed.
+    from .crumb import get_manifest
+    from .copier import manifest_diff, scan_tree
+    from .ignore import IgnoreRules, copy_patterns
+    try:
+        rules = None
+        if os.path.isdir(origin):
+            rules = IgnoreRules(copy_patterns(origin, exclude))
+            _, files = scan_tree(origin, rules)
+        else:
+            files = {'': os.stat(origin)}
+        manifest = get_manifest(dst) if dst is not None else None
+        changed = True
+        if manifest is not None:
+            installed = dst if kind == 'copy' else None
+            diff = manifest_diff(origin, installed, manifest, rules)
+            changed = bool(diff)
+            if kind == 'copy' or not changed:
+                files = {rel: files[rel] for rel in diff if rel in files}
+    except OSError:
+        return True, 0  # the origin is gone, the copy will say so
+    return changed, sum(st.st_size for st in files.values())
+
+
+def plan(top, wanted, exclude=()):
+    # The steps that take the environment to `wanted`, one per package:
+    # result(action, kind, name, origin, old, bytes), where `old` is a
+    # list of the (kind, origin, path) to remove first. `exclude` are
+    # the --exclude patterns of the copies.
+    current = _current(top)
+    steps = []
+    for mode, origin in wanted:
+        name = _name(origin)
+        old = current.pop(name, [])
+        keep = [o for o in old if o[0] == mode and o[1] == origin]
+        if keep:
+            old = [o for o in old if o is not keep[0]]
+            action = 'ok'
+            nbytes = 0
+            if mode in ('copy', 'zip'):
+                changed, nbytes = _copy_bytes(origin, str(keep[0][2]),
+                                              exclude, mode)
+                if changed:
+                    action = 'update'
+            if old:
+                action = 'replace'
+        else:
+            action = 'replace' if old else 'add'
+            nbytes = 0
+            if mode in ('copy', 'zip'):
+                _, nbytes = _copy_bytes(origin, None, exclude)
+        steps.append(result(action=action, kind=mode, name=name,
+                            origin=origin, old=old, bytes=nbytes))
+
+    for name in sorted(current):
+        steps.append(result(action='remove', kind=None, name=name,
+                            origin=None, old=current[name], bytes=0))
+    return steps
+
+
+def report(top, steps, out=None):
+    if out is not None:
+        for s in steps:
+            out.emit({'type': 'sync', 'action': s.action, 'kind': s.kind,
+                      'name': s.name, 'origin': s.origin, 'bytes': s.bytes,
+                      'remove': [{'kind': k, 'origin': o, 'path': str(p)}
+                                 for k, o, p in s.old]})
+        return
+
+    counts = {}
+    for s in steps:
+        counts[s.action] = counts.get(s.action, 0) + 1
+    stdout = top.stdout
+    fprint(stdout, '# sync: add=%i, update=%i, replace=%i, remove=%i, '
+                   'unchanged=%i, %i bytes to copy' % (
+        counts.get('add', 0), counts.get('update', 0),
+        counts.get('replace', 0), counts.get('remove', 0),
+        counts.get('ok', 0), sum(s.bytes for s in steps)))
+    for s in steps:
+        if s.action == 'ok':
+            continue
+        for kind, origin, path in s.old:
+            fprint(stdout, '  %-8s %-8s %s  (%s)' % (
+                'remove', kind, str(path), origin))
+        if s.kind is not None:
+            size = ''
+            if s.kind in ('copy', 'zip'):
+                size = ' (%i bytes)' % s.bytes
+            action = 'add' if s.action == 'replace' else s.action
+            fprint(stdout, '  %-8s %-8s %s%s' % (action, s.kind, s.origin,
+                                                size))
+
+
+def apply(top, steps, flags):
+    # Run the steps, removals first. Returns the (cmd, what, error,
+    # None) of every failed operation and the number of operations.
+    todo = []
+    for s in steps:
+        todo.extend((UNDO[kind], origin) for kind, origin, path in s.old)
+    for s in steps:
+        if s.action in ('add', 'update', 'replace'):
+            todo.append((s.kind, s.origin))
+
+    if len(todo) > 1:
+        from . import index
+        flags.snapshot = index.Snapshot(top)
+
+    collected = []
+    try:
+        for cmd, what in todo:
+            err = core._run_item(top, cmd, what, flags)
+            if err is not None:
+                collected.append((cmd, what, err, None))
+    finally:
+        if flags.snapshot is not None:
+            flags.snapshot.save()
+    return collected, len(todo)
@@ -0,0 +1,136 @@
+##
+##   Copyright 2022 Roger D. Serwy
+##
+##   Licensed under the Apache License, Version 2.0 (the "License");
+##   you may not use this file except in compliance with the License.
+##   You may obtain a copy of the License at
+##
+##       http://www.apache.org/licenses/LICENSE-2.0
+##
+##   Unless required by applicable law or agreed to in writing, software
+##   distributed under the License is distributed on an "AS IS" BASIS,
+##   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##   See the License for the specific language governing permissions and
+##   limitations under the License.
+##
+
+# Poll the origins of copied packages and copy them again when they
+# change. Only stat() is used, so no inotify library is needed.
+
+import os
+import time
+
+from .common import *
+from .crumb import *
+from .copier import scan_tree
+from .ignore import crumb_rules
+from . import ops, core
+
+# Polling spends at most 1/DUTY of the wall time scanning.
+DUTY = 10
+
+
+def signature(origin, rules=None):
+    # A cheap fingerprint of a tree from the size and mtime of its files,
+    # leaving out those that the copy leaves out.
+    if os.path.isdir(origin):
+        dirs, files = scan_tree(origin, rules)
+        items = sorted((rel, st.st_size, st.st_mtime_ns)
+                       for rel, st in files.items())
+        return hash((tuple(dirs), tuple(items)))
+    st = os.stat(origin)
+    return hash((st.st_size, st.st_mtime_ns))
+
+
+class _Watched:
+    def __init__(self, path, origin, synced, rules):
+        self.path = path
+        self.origin = origin
+        self.rules = rules     # what the copy leaves out
+        self.synced = synced   # signature of the last copy, None if stale
+        self.seen = synced     # signature at the last poll
+        self.since = None      # when `seen` was first observed
+
+
+def watch(top, flags, get_copies, interval=1.0, max_interval=30.0,
+          settle=1.0, cycles=None):
+    # `get_copies` returns the paths of the copied packages to watch.
+    stdout, stderr = top.stdout, top.stderr
+
+    watched = {}
+    delay = interval
+    n = 0
+    while cycles is None or n < cycles:
+        n += 1
+        t0 = time.monotonic()
+
+        current = set()
+        for p in get_copies():
+            current.add(p)
+            c, cfile = get_crumb(p)
+            origin = (c or {}).get('from')
+            if origin is None:
+                continue
+            w = watched.get(p)
+            if w is None or w.origin != origin:
+                rules = crumb_rules(c)
+                try:
+                    sig = signature(origin, rules)
+                    stale = ops._compare_crumb(p).changed
+                except (OSError, SitePathFailure):
+                    continue
+                w = watched[p] = _Watched(p, origin, None if stale else sig,
+                                          rules)
+                w.seen = sig
+                w.since = time.monotonic()
+                fprint(stdout, 'watch: %r <-- %r' % (str(p), origin))
+
+        for p in set(watched) - current:
+            del watched[p]
+
+        resynced = 0
+        waiting = 0     # changes that have not settled yet
+        for w in watched.values():
+            try:
+                sig = signature(w.origin, w.rules)
+            except OSError:
+                continue    # the origin is gone or mid-rename
+
+            now = time.monotonic()
+            if sig != w.seen:
+                # still changing, wait for the edits to settle
+                w.seen = sig
+                w.since = now
+                waiting += 1
+                continue
+            if sig == w.synced:
+                continue
+            if now - w.since < settle:
+                waiting += 1
+                continue
+
+            # the crumb records when this copy was made
+            top.now = core._isonow()
+            try:
+                ops.copy(top, w.origin, flags)
+            except (SitePathException, SitePathFailure) as err:
+                fprint(stderr, 'watch: %s' % err)
+                continue
+            w.synced = sig
+            w.rules = crumb_rules(get_crumb(w.path)[0])
+            resynced += 1
+
+        # Back off while nothing happens, and never spend more than
+        # 1/DUTY of the time scanning, however many trees are watched.
+        # A change waiting to settle is polled at the base interval.
+        busy = time.monotonic() - t0
+        if resynced or waiting:
+            delay = interval
+        else:
+            delay = min(max_interval, max(delay * 1.5, interval))
+        delay = max(delay, busy * (DUTY - 1))
+
+        if cycles is None or n < cycles:
+            time.sleep(delay)
+
+    return watched
@@ -22,11 +22,16 @@ import pathlib
 import io
 import sys
 import platform
+import subprocess
 
 
 WINDOWS = (platform.system() == 'Windows')
 
 import sitepath
+import sitepath.index
+import sitepath.ops
+import sitepath.copier
+import sitepath.registry
 from sitepath import core
 
 
@@ -170,6 +175,542 @@ class TestSitePath(unittest.TestCase):
         self.do('copy my_project')
         self.assertTrue((self.site_packages / 'my_project').is_dir())
 
+    def test_recopy_sync(self):
+        sub = self.my_project / 'sub'
+        sub.mkdir()
+        _write_text(sub / 'a.py', 'a=1')
+        _write_text(sub / 'b.py', 'b=1')
+        self.do('copy my_project')
+
+        dst = self.site_packages / 'my_project'
+        init_ino = (dst / '__init__.py').stat().st_ino
+
+        (sub / 'b.py').unlink()
+        _write_text(sub / 'a.py', 'a=22')
+        _write_text(self.my_project / 'c.py', 'c=1')
+        self.do('copy my_project')
+
+        self.assertEqual(_read_text(dst / 'sub' / 'a.py'), 'a=22')
+        self.assertFalse((dst / 'sub' / 'b.py').exists())
+        self.assertTrue((dst / 'c.py').exists())
+        # unchanged files are left alone
+        self.assertEqual((dst / '__init__.py').stat().st_ino, init_ino)
+
+    def test_recopy_interrupted(self):
+        self.do('copy my_project')
+        dst = self.site_packages / 'my_project'
+        _write_text(self.my_project / '__init__.py', 'project=2')
+        _write_text(self.my_project / 'new.py', 'new=1')
+
+        def broken(*args):
+            raise OSError('interrupted')
+
+        orig = sitepath.copier._do_copy
+        sitepath.copier._do_copy = broken
+        try:
+            with self.assertRaises(core.SitePathFailure):
+                self.do('copy my_project')
+        finally:
+            sitepath.copier._do_copy = orig
+
+        # the previous copy is intact, nothing is staged
+        self.assertEqual(_read_text(dst / '__init__.py'), 'project=True\n')
+        self.assertFalse((dst / 'new.py').exists())
+        staged = [p for p in os.listdir(str(self.site_packages))
+                  if p.endswith('.sitepath-stage')]
+        self.assertEqual(staged, [])
+
+        # a failed swap puts the previous copy back
+        rename, replace = os.rename, os.replace
+        def no_swap(func):
+            def swap(src, dst):
+                if src.endswith('.sitepath-stage'):
+                    raise OSError('interrupted')
+                func(src, dst)
+            return swap
+
+        os.rename, os.replace = no_swap(rename), no_swap(replace)
+        try:
+            with self.assertRaises(core.SitePathFailure):
+                self.do('copy my_project')
+        finally:
+            os.rename, os.replace = rename, replace
+        self.assertEqual(_read_text(dst / '__init__.py'), 'project=True\n')
+
+        self.do('copy my_project')
+        self.assertEqual(_read_text(dst / '__init__.py'), 'project=2')
+
+    @unittest.skipIf(WINDOWS, 'POSIX permissions')
+    def test_recopy_modes(self):
+        import stat
+        import threading
+        sub = self.my_project / 'sub'
+        sub.mkdir()
+        os.chmod(str(sub), 0o751)
+        os.chmod(str(self.my_project), 0o755)
+        dst = self.site_packages / 'my_project'
+        trash = self.site_packages / sitepath.copier.TRASH
+        leftover = trash / 'my_project.killed'
+        (leftover / 'my_project').mkdir(parents=True)
+        os.utime(str(leftover), (0, 0))
+        fresh = trash / 'my_project.running'
+        fresh.mkdir()
+
+        for i in range(2):
+            self.do('copy my_project')
+            self.assertEqual(stat.S_IMODE(dst.stat().st_mode), 0o755)
+            self.assertEqual(stat.S_IMODE((dst / 'sub').stat().st_mode),
+                             0o751)
+
+        # the old tree and the leftovers of a killed run are deleted
+        for t in threading.enumerate():
+            if t is not threading.current_thread():
+                t.join()
+        self.assertEqual(os.listdir(str(trash)), ['my_project.running'])
+
+    def test_copy_backends(self):
+        crumb = self.site_packages / 'my_project'
+        init = self.site_packages / 'my_project' / '__init__.py'
+        origin_ino = (self.my_project / '__init__.py').stat().st_ino
+
+        for backend in ['python', 'kernel', 'reflink', 'auto']:
+            self.do('copy --backend %s my_project' % backend)
+            c, cfile = sitepath.crumb.get_crumb(crumb)
+            self.assertTrue(c['backend'])
+            self.assertNotEqual(init.stat().st_ino, origin_ino)
+
+        self.do('copy --backend hardlink my_project')
+        c, cfile = sitepath.crumb.get_crumb(crumb)
+        self.assertEqual(c['backend'], 'hardlink')
+        self.assertEqual(init.stat().st_ino, origin_ino)
+
+        # switching away from hardlinks copies everything again
+        self.do('copy --backend python my_project')
+        self.assertNotEqual(init.stat().st_ino, origin_ino)
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy --backend nope my_project')
+
+        # without fcntl, as on Windows, auto copies with python
+        _write_text(self.my_project / '__init__.py', 'project=2')
+        fcntl = sys.modules.get('fcntl')
+        sys.modules['fcntl'] = None
+        try:
+            self.do('copy my_project')
+        finally:
+            if fcntl is None:
+                del sys.modules['fcntl']
+            else:
+                sys.modules['fcntl'] = fcntl
+        c, cfile = sitepath.crumb.get_crumb(crumb)
+        self.assertEqual(c['backend'], 'python')
+        self.assertEqual(_read_text(init), 'project=2')
+
+    def test_copy_jobs(self):
+        for i in range(20):
+            _write_text(self.my_project / ('m%i.py' % i), 'x=%i' % i)
+        self.do('copy --jobs 4 my_project')
+
+        dst = self.site_packages / 'my_project'
+        self.assertEqual(_read_text(dst / 'm7.py'), 'x=7')
+        self.assertTrue((self.site_packages / 'my_project.sitepath').exists())
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy --jobs 0 my_project')
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy my_project --jobs')
+
+    def make_venv(self, name):
+        import venv
+        try:
+            venv.create(str(self.tmp_dir / name), with_pip=False,
+                        symlinks=not WINDOWS)
+        except Exception as err:
+            self.skipTest('venv unavailable: %s' % err)
+
+    def test_copy_envs(self):
+        self.make_venv('env1')
+        self.make_venv('env2')
+        _write_text(self.tmp_dir / 'envs.txt', 'env1\n# comment\nenv2\n')
+
+        self.top.stdout = io.StringIO()
+        hashed = []
+        hash_file = sitepath.copier.hash_file
+        def counting(p):
+            hashed.append(p)
+            return hash_file(p)
+        sitepath.copier.hash_file = counting
+        try:
+            self.do('copy my_project --envs-from envs.txt --backend kernel')
+        finally:
+            sitepath.copier.hash_file = hash_file
+
+        for name in ('env1', 'env2'):
+            found = list((self.tmp_dir / name).glob('**/my_project.sitepath'))
+            self.assertEqual(len(found), 1)
+        # the origin is hashed once for both environments
+        self.assertEqual(len(hashed), 1)
+        self.assertIn('# env env2 (success=1', self.top.stdout.getvalue())
+
+        # python copies hash what they read, and nothing else
+        sitepath.copier.hash_file = counting
+        try:
+            self.do('copy my_file.py --envs-from envs.txt')
+        finally:
+            sitepath.copier.hash_file = hash_file
+        self.assertEqual(len(hashed), 1)
+
+        self.top.stdout = io.StringIO()
+        self.do('info --env env2')
+        v = self.top.stdout.getvalue()
+        self.assertIn('# env env2', v)
+        self.assertIn(str(self.my_file), v)
+
+        with self.assertRaises(core.SitePathFailure):
+            self.do('uncopy my_project nothere --env env1 --env env2')
+        self.assertFalse(list(self.tmp_dir.glob('env*/**/my_project')))
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy my_project --env missing')
+
+    def test_copy_compile(self):
+        import importlib.util
+        self.do('copy my_project --compile --optimize 0,1 --jobs 2')
+        src = str(self.site_packages / 'my_project' / '__init__.py')
+        for level in ('', 1):
+            pyc = importlib.util.cache_from_source(src, optimization=level)
+            self.assertTrue(os.path.exists(pyc))
+        c, _ = sitepath.crumb.get_crumb(self.site_packages / 'my_project')
+        self.assertEqual(c['compiled'], [0, 1])
+
+        self.top.stdout = io.StringIO()
+        self.do('list changed')
+        self.assertNotIn('stale', self.top.stdout.getvalue())
+
+        # a re-copy keeps the bytecode of unchanged sources
+        pyc = importlib.util.cache_from_source(src)
+        ino = os.stat(pyc).st_ino
+        _write_text(self.my_project / 'new.py', 'new = 1')
+        self.do('copy my_project --compile --optimize 0,1')
+        self.assertEqual(os.stat(pyc).st_ino, ino)
+        new = str(self.site_packages / 'my_project' / 'new.py')
+        self.assertTrue(os.path.exists(importlib.util.cache_from_source(new)))
+
+        # an edit of the installed source leaves its bytecode stale
+        _write_text(src, 'project = False')
+        self.top.stdout = io.StringIO()
+        self.do('list changed')
+        self.assertIn('# stale bytecode', self.top.stdout.getvalue())
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy my_project --optimize 3')
+
+    def test_copy_exclude(self):
+        proj = self.my_project
+        for rel in ('.git/HEAD', '__pycache__/x.cpython.pyc', 'tests/t.py',
+                    'data.csv', 'sub/data.csv', 'sub/__init__.py'):
+            (proj / rel).parent.mkdir(exist_ok=True)
+            _write_text(proj / rel, 'x')
+        _write_text(proj / '.sitepathignore', '# data\n/data.csv\n')
+
+        self.do('copy my_project --exclude tests/')
+        dst = self.site_packages / 'my_project'
+        self.assertEqual(
+            sorted(str(p.relative_to(dst)) for p in dst.rglob('*')),
+            ['__init__.py', 'sub', os.path.join('sub', '__init__.py'),
+             os.path.join('sub', 'data.csv')])
+        c, _ = sitepath.crumb.get_crumb(dst)
+        self.assertIn('/data.csv', c['exclude'])
+        self.assertIn('tests/', c['exclude'])
+
+        # left out files are not drift, for the manifest or --deep
+        _write_text(proj / '.git' / 'HEAD', 'changed')
+        _write_text(proj / '__pycache__' / 'y.cpython.pyc', 'new')
+        for opts in ('', ' --deep'):
+            self.top.stdout = io.StringIO()
+            self.do('list changed' + opts)
+            self.assertNotIn(str(proj), self.top.stdout.getvalue())
+
+        _write_text(proj / 'sub' / 'data.csv', 'changed')
+        for opts in ('', ' --deep'):
+            self.top.stdout = io.StringIO()
+            self.do('list changed' + opts)
+            self.assertIn(str(proj), self.top.stdout.getvalue())
+
+        # there is no negation, as in .gitignore
+        _write_text(proj / '.sitepathignore', '*.csv\n!keep.csv\n')
+        with self.assertRaises(core.SitePathException):
+            self.do('copy my_project')
+
+    def test_changed_legacy_copy(self):
+        # a copy made before ignore rules is compared as filecmp.dircmp
+        # did, without the __pycache__ that importing the origin writes
+        proj = self.my_project
+        self.do('copy my_project')
+        dst = self.site_packages / 'my_project'
+        c, _ = sitepath.crumb.get_crumb(dst)
+        del c['exclude']
+        sitepath.crumb.place_crumb(dst, c)
+
+        (proj / '__pycache__').mkdir()
+        _write_text(proj / '__pycache__' / 'x.cpython.pyc', 'new')
+        for opts in ('', ' --deep'):
+            self.top.stdout = io.StringIO()
+            self.do('list changed' + opts)
+            self.assertNotIn(str(proj), self.top.stdout.getvalue())
+
+    def test_zip(self):
+        import zipfile
+        sp = self.site_packages
+        sub = self.my_project / 'sub'
+        sub.mkdir()
+        _write_text(sub / '__init__.py', 'sub = True')
+        _write_text(self.my_project / '.git', 'x')
+        self.do('zip my_project --compile')
+        self.do('zip my_file.py')
+
+        archive = sp / 'my_project.zip'
+        if not WINDOWS:
+            import stat
+            mode = stat.S_IMODE(self.my_project.stat().st_mode) & 0o666
+            self.assertEqual(stat.S_IMODE(archive.stat().st_mode), mode)
+        with zipfile.ZipFile(str(archive)) as zf:
+            self.assertEqual(sorted(zf.namelist()), [
+                'my_project/', 'my_project/__init__.py',
+                'my_project/__init__.pyc', 'my_project/sub/',
+                'my_project/sub/__init__.py', 'my_project/sub/__init__.pyc'])
+        self.assertEqual(_read_text(sp / 'my_project.sitepath-zip.pth'),
+                         'my_project.zip\n')
+
+        code = ('import site, sys; site.addsitedir(sys.argv[1]); '
+                'import my_project.sub, my_file; '
+                'print(my_project.sub.__file__, my_file.__file__)')
+        proc = subprocess.run([sys.executable, '-S', '-c', code, str(sp)],
+                              stdout=subprocess.PIPE, check=True,
+                              universal_newlines=True)
+        self.assertEqual(proc.stdout.split(), [
+            # from the bytecode in the archive
+            os.path.join(str(archive), 'my_project', 'sub', '__init__.pyc'),
+            os.path.join(str(sp / 'my_file.zip'), 'my_file.py')])
+
+        self.top.stdout = io.StringIO()
+        self.do('list zips')
+        self.do('info my_project')
+        out = self.top.stdout.getvalue()
+        self.assertIn(str(self.my_project), out)
+        self.assertIn("how: 'zip'", out)
+
+        with self.assertRaises(core.SitePathException):
+            self.do('copy my_project')
+        for opts in ('', ' --deep'):
+            self.top.stdout = io.StringIO()
+            self.do('list changed' + opts)
+            self.assertNotIn(str(self.my_project), self.top.stdout.getvalue())
+        _write_text(sub / '__init__.py', 'sub = False')
+        for opts in ('', ' --deep'):
+            self.top.stdout = io.StringIO()
+            self.do('list changed' + opts)
+            self.assertIn(str(self.my_project), self.top.stdout.getvalue())
+
+        self.do('unzip my_project')
+        self.do('unzip -n my_file.py')
+        self.assertEqual(sorted(os.listdir(str(sp))),
+                         [sitepath.index.INDEX])
+
+    def test_zip_before_1980(self):
+        # a zip archive cannot hold times before 1980
+        import zipfile
+        for p in (self.my_project / '__init__.py', self.my_project):
+            os.utime(str(p), (0, 0))
+        self.do('zip my_project --compile')
+        with zipfile.ZipFile(str(self.site_packages / 'my_project.zip')) as zf:
+            for info in zf.infolist():
+                self.assertEqual(info.date_time, (1980, 1, 1, 0, 0, 0))
+        self.do('list changed')
+
+    def test_develop_shared_pth(self):
+        other = self.tmp_dir / 'other'
+        other.mkdir()
+        _write_text(other / '__init__.py', '')
+        shared = self.site_packages / 'sitepath.pth'
+
+        self.do('develop my_project --shared-pth')
+        self.do('develop other --shared-pth')
+        self.do('develop my_project')    # stays in the shared file
+        self.assertFalse(
+            (self.site_packages / 'my_project.sitepath.pth').exists())
+        lines = _read_text(shared).splitlines()
+        self.assertEqual([l for l in lines if not l.startswith('#')],
+                         [str(self.tmp_dir)])
+
+        self.top.stdout = io.StringIO()
+        self.do('list develops')
+        self.do('info other')
+        out = self.top.stdout.getvalue()
+        self.assertIn(str(self.my_project), out)
+        self.assertIn(str(shared), out)
+
+        self.do('undevelop my_project')
+        self.assertNotIn('my_project', _read_text(shared))
+        self.do('undevelop other')
+        self.assertFalse(shared.exists())
+        with self.assertRaises(core.SitePathFailure):
+            self.do('undevelop other')
+
+    def test_develop_finder(self):
+        finder_pth = self.site_packages / 'sitepath-finder.pth'
+        module = self.site_packages / '_sitepath_finder.py'
+        self.do('develop my_file.py')
+        self.do('develop my_project --finder')
+        self.do('develop my_file.py --finder')
+        self.assertFalse(
+            (self.site_packages / 'my_file.sitepath.pth').exists())
+        self.assertTrue(module.exists())
+        self.assertNotIn('\n%s\n' % self.tmp_dir, _read_text(finder_pth))
+
+        # only the interpreter's own site-packages are read with -S
+        code = ('import site, sys; n = len(sys.path); site.addsitedir(%r); '
+                'import my_project, my_file; '
+                'print(my_project.project, my_file.file, len(sys.path) - n)'
+                % str(self.site_packages))
+        proc = subprocess.run([sys.executable, '-S', '-c', code],
+                              cwd=str(self.site_packages),
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              universal_newlines=True)
+        self.assertEqual(proc.stdout.split(), ['True', 'True', '1'],
+                         proc.stderr)
+
+        self.top.stdout = io.StringIO()
+        self.do('list develops')
+        self.assertIn(str(self.my_project), self.top.stdout.getvalue())
+
+        self.do('undevelop my_project')
+        self.do('undevelop my_file')
+        self.assertFalse(finder_pth.exists())
+        self.assertFalse(module.exists())
+
+    def test_registry(self):
+        sp = str(self.site_packages)
+        registry = sitepath.registry
+        self.do('copy my_file.py')
+        self.do('registry init')
+        self.assertTrue(registry.exists(sp))
+        self.assertFalse(os.path.exists(
+            os.path.join(sp, sitepath.index.INDEX)))
+
+        self.do('copy my_project')
+        self.do('develop my_project')
+        # patched in place, still fresh
+        recs = registry.find(sp, kind='copy')
+        self.assertEqual(sorted(r['name'] for r in recs),
+                         ['my_file.py', 'my_project'])
+        self.assertEqual(len(registry.find(sp, name='my_file')), 1)
+
+        # a crumb changed behind its back is seen
+        _write_text(self.site_packages / 'my_file.py.sitepath', '{}')
+        self.assertIsNone(registry.find(sp, name='my_file'))
+
+        self.top.stdout = io.StringIO()
+        self.do('info')
+        self.do('registry query --kind develop')
+        out = self.top.stdout.getvalue()
+        self.assertIn('my_file:', out)
+        self.assertIn('develop  %s' % os.path.join(
+            sp, 'my_project.sitepath.pth'), out)
+
+        self.do('registry drop')
+        self.assertFalse(registry.exists(sp))
+        self.do('info my_project')
+
+        # a site-packages that cannot be written is skipped
+        usp = str(self.user_site_packages)
+        create = registry.create
+        def readonly(d):
+            if d == sp:
+                raise OSError('read-only')
+            create(d)
+        registry.create = readonly
+        try:
+            self.do('registry init')
+        finally:
+            registry.create = create
+        self.assertFalse(registry.exists(sp))
+        self.assertTrue(registry.exists(usp))
+        self.assertIn('note: unable to init', self.top.stderr.getvalue())
+
+    def test_sync(self):
+        sp = self.site_packages
+        for name in ('old', 'tool'):
+            (self.tmp_dir / name).mkdir()
+            _write_text(self.tmp_dir / name / '__init__.py', 'x = 1')
+        self.do('copy my_project')
+        self.do('copy old')
+        self.do('develop my_file.py')
+        _write_text(self.my_project / 'more.py', '12345')
+
+        _write_text(self.tmp_dir / 'packages.txt', '\n'.join([
+            '# wanted',
+            'copy my_project',
+            'copy my_file.py',
+            'develop\t tool',
+        ]))
+        self.top.stdout = io.StringIO()
+        self.do('sync --plan packages.txt')
+        out = self.top.stdout.getvalue()
+        self.assertIn('# sync: add=1, update=1, replace=1, remove=1, '
+                      'unchanged=0, 14 bytes to copy', out)
+        self.assertIn('update   copy     %s (5 bytes)' % self.my_project, out)
+        self.assertIn('remove   develop  %s' % (
+            sp / 'my_file.sitepath.pth'), out)
+        self.assertTrue((sp / 'old').exists())
+        self.assertFalse((sp / 'my_project' / 'more.py').exists())
+
+        self.do('sync packages.txt')
+        self.assertFalse((sp / 'old').exists())
+        self.assertFalse((sp / 'my_file.sitepath.pth').exists())
+        self.assertTrue((sp / 'my_file.py.sitepath').exists())
+        self.assertTrue((sp / 'my_project' / 'more.py').exists())
+        self.assertTrue((sp / 'tool.sitepath.pth').exists())
+
+        self.top.stdout = io.StringIO()
+        self.do('sync packages.txt')
+        self.assertEqual(self.top.stdout.getvalue(),
+                         '# sync: add=0, update=0, replace=0, remove=0, '
+                         'unchanged=3, 0 bytes to copy\n')
+
+        # a file removed from the origin is a change, with nothing to copy
+        os.remove(str(self.my_project / 'more.py'))
+        self.top.stdout = io.StringIO()
+        self.do('sync --plan packages.txt')
+        self.assertIn('update=1', self.top.stdout.getvalue())
+
+        _write_text(self.tmp_dir / 'packages.txt', 'move my_project')
+        with self.assertRaises(core.SitePathException):
+            self.do('sync packages.txt')
+
+    def test_startup_cost(self):
+        self.make_venv('env1')
+        self.do('develop my_project --env env1')
+        self.do('copy my_file.py --env env1')
+        zipped = self.tmp_dir / 'zipped'
+        zipped.mkdir()
+        _write_text(zipped / '__init__.py', '')
+        self.do('zip zipped --env env1')
+
+        self.top.stdout = io.StringIO()
+        self.do('startup-cost --env env1 --repeat 1')
+        out = self.top.stdout.getvalue()
+        self.assertIn('# startup:', out)
+        self.assertIn('my_project.sitepath.pth', out)
+        self.assertIn('+ sys.path %s' % self.tmp_dir, out)
+        self.assertIn('my_file.py', out)
+        self.assertNotIn('import failed', out)
+        # the .pth file of the archive is timed too
+        zip_line, = [l for l in out.splitlines()
+                     if l.split()[:1] == ['zip']]
+        self.assertNotEqual(zip_line.split()[1], '-')
+
     def test_redevelop(self):
         self.assertFalse((self.site_packages / 'my_project.sitepath.pth').exists())
         self.do('develop my_project')
@@ -221,6 +762,98 @@ class TestSitePath(unittest.TestCase):
         v_active = [i for i in v if i.strip() and not i.startswith('#')]
         self.assertTrue(str(self.my_file) in v_active)
 
+    def test_status_scan(self):
+        self.do('copy my_project')
+        self.do('develop my_file.py')
+        _write_text(self.site_packages / 'other.pth', '')
+        _write_text(self.site_packages / 'orphan.sitepath', '{}')
+
+        kinds = [(e.kind, e.name) for e in core._iter_status(self.top)]
+        self.assertEqual(kinds, [
+            ('pth', 'my_file.sitepath.pth'),
+            ('develop', 'my_file'),
+            ('pth', 'other.pth'),
+            ('copy', 'my_project'),
+        ])
+
+        status = core._get_status(self.top)
+        self.assertEqual(status.names, {'my_file', 'my_project'})
+        self.assertEqual(len(status.pth), 2)
+
+    def test_status_index(self):
+        sp = str(self.site_packages)
+        index_file = os.path.join(sp, sitepath.index.INDEX)
+        self.do('list copies')
+        self.assertFalse(os.path.exists(index_file))   # reading writes none
+
+        # the commands that change the directory write the index
+        self.do('copy my_project')
+        recs = sitepath.index.load(sp)
+        self.assertEqual([(r['kind'], r['name']) for r in recs],
+                         [('copy', 'my_project')])
+
+        # a package added in the same mtime tick as the index is seen
+        st = os.stat(sp)
+        shutil.copy(str(self.my_file), sp)
+        _write_text(self.site_packages / 'my_file.py.sitepath',
+                    '{"from": "elsewhere", "base": "my_file.py"}')
+        os.utime(sp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertIsNone(sitepath.index.load(sp))
+        os.remove(os.path.join(sp, 'my_file.py'))
+        os.remove(os.path.join(sp, 'my_file.py.sitepath'))
+        os.utime(sp, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        # rewriting a crumb in place invalidates the index
+        crumb = self.site_packages / 'my_project.sitepath'
+        _write_text(crumb, '{"from": "elsewhere", "base": "my_project"}')
+        st = crumb.stat()
+        os.utime(str(crumb), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIsNone(sitepath.index.load(sp))
+
+        x = io.StringIO()
+        self.top.stdout = x
+        self.do('list copies')
+        self.assertIn('elsewhere', x.getvalue())
+        self.assertIsNone(sitepath.index.load(sp))
+
+        self.do('uncopy -n my_project')
+        self.assertEqual(sitepath.index.load(sp), [])
+
+    def test_status_index_batch(self):
+        sp = str(self.site_packages)
+        lines = []
+        for i in range(4):
+            p = self.tmp_dir / ('pkg%i' % i)
+            p.mkdir()
+            _write_text(p / '__init__.py', '')
+            lines.append(str(p))
+        _write_text(self.tmp_dir / 'reqs.txt', '\n'.join(lines))
+
+        # a batch writes the index once, when it is over
+        saved = []
+        _save = sitepath.index._save
+        sitepath.index._save = lambda d, idx: (saved.append(d),
+                                               _save(d, idx))
+        try:
+            self.do('copy -r reqs.txt')
+            self.assertEqual(saved, [sp])
+            del saved[:]
+            self.do('copy -j 4 -r reqs.txt')
+            self.assertEqual(saved, [sp])
+        finally:
+            sitepath.index._save = _save
+        self.assertEqual([r['name'] for r in sitepath.index.load(sp)],
+                         ['pkg0', 'pkg1', 'pkg2', 'pkg3'])
+
+        # the last of overlapping edits rebuilds the index
+        with sitepath.index.editing(sp, 'pkg0'):
+            with sitepath.index.editing(sp, 'pkg1'):
+                shutil.rmtree(os.path.join(sp, 'pkg1'))
+                os.remove(os.path.join(sp, 'pkg1.sitepath'))
+            self.assertIsNone(sitepath.index.load(sp))
+        self.assertEqual([r['name'] for r in sitepath.index.load(sp)],
+                         ['pkg0', 'pkg2', 'pkg3'])
+
     def test_help(self):
         self.do('help')
         self.do('-h')
@@ -236,6 +869,75 @@ class TestSitePath(unittest.TestCase):
         self.do('copy -r ./reqs.txt')
         self.assertTrue(spf.exists())
 
+        # streamed one line at a time, unless -j needs them all first
+        flags = core._proc_args(self.top, ['-r', './reqs.txt'], False)
+        self.assertIsInstance(flags.items, core._Lines)
+        self.assertEqual(list(flags.items), [str(self.my_file)])
+        flags = core._proc_args(self.top, ['-j', '2', '-r', './reqs.txt'],
+                                False)
+        self.assertEqual(flags.items, [str(self.my_file)])
+
+    def test_copy_from_list_parallel(self):
+        lines = []
+        for i in range(6):
+            p = self.tmp_dir / ('pkg%i' % i)
+            p.mkdir()
+            _write_text(p / '__init__.py', 'x' * (i * 100))
+            lines.append(str(p))
+        lines.append(str(self.tmp_dir / 'missing'))
+        lines.append(lines[0])   # same name twice, run in order
+
+        req_file = self.tmp_dir / 'reqs.txt'
+        _write_text(req_file, '\n'.join(lines))
+
+        # the copies of a batch file start with the largest origin
+        sized = []
+        class Observer:
+            def start(self, name, item):
+                if name == 'sizing':
+                    sized.append(name)
+            def end(self, name, item, seconds):
+                pass
+        self.top.observer = Observer()
+
+        with self.assertRaises(core.SitePathException) as cm:
+            self.do('copy -j 4 -r ./reqs.txt')
+
+        self.assertIn('Result (success=7, errors=1, failures=0)',
+                      str(cm.exception))
+        for i in range(6):
+            self.assertTrue((self.site_packages / ('pkg%i' % i)).is_dir())
+        self.assertEqual(sized, ['sizing'])
+        self.assertEqual(self.top.stderr.getvalue(), '')
+
+    def test_copy_from_stdin(self):
+        lines = ['# generated']
+        for i in range(20):
+            p = self.tmp_dir / ('pkg%i' % i)
+            p.mkdir()
+            _write_text(p / '__init__.py', 'x = %i' % i)
+            lines.append(str(p))
+        lines.append(str(self.tmp_dir / 'missing'))
+        lines.append(lines[1])   # same name twice, run in order
+
+        self.top.stdin = io.StringIO('\n'.join(lines) + '\n')
+        with self.assertRaises(core.SitePathException) as cm:
+            self.do('copy -j 3 --progress -r -')
+        self.assertIn('Result (success=21, errors=1, failures=0)',
+                      str(cm.exception))
+        self.assertIn('# copy: 22 item(s) done, 1 failed',
+                      self.top.stderr.getvalue())
+        for i in range(20):
+            self.assertTrue((self.site_packages / ('pkg%i' % i)).is_dir())
+
+        # progress is only reported when asked for
+        self.top.stderr = io.StringIO()
+        self.top.stdin = io.StringIO('\n'.join(lines[1:-2]))
+        self.do('uncopy -nr -')
+        self.assertNotIn('item(s) done', self.top.stderr.getvalue())
+        self.assertFalse((self.site_packages / 'pkg0').exists())
+        self.assertFalse((self.site_packages / 'pkg19').exists())
+
     def test_develop_from_list(self):
         sdf = self.site_packages / 'my_file.sitepath.pth'
         sdd = self.site_packages / 'my_project.sitepath.pth'
@@ -252,6 +954,41 @@ class TestSitePath(unittest.TestCase):
         self.assertTrue(sdd.exists())
         self.assertTrue(sdf.exists())
 
+    def test_batch_snapshot(self):
+        other = self.site_packages / 'other'
+        other.mkdir()
+        (self.tmp_dir / 'other').mkdir()
+        req_file = self.tmp_dir / 'reqs.txt'
+        _write_text(req_file, '\n'.join(['my_project', 'other', 'my_file.py']))
+
+        with self.assertRaises(core.SitePathFailure) as cm:
+            self.do('copy -r ./reqs.txt')
+        self.assertIn('not created by sitepath', str(cm.exception))
+        self.assertIn('success=2', str(cm.exception))
+        self.assertTrue((self.site_packages / 'my_project.sitepath').exists())
+        self.assertTrue((self.site_packages / 'my_file.py.sitepath').exists())
+
+        # the ops keep the snapshot current
+        flags = core._proc_args(self.top, ['my_project'], False)
+        flags.snapshot = sitepath.index.Snapshot(self.top)
+        sp = str(self.site_packages)
+        self.assertEqual(flags.snapshot.placed(sp, 'my_project')['kind'],
+                         'copy')
+        sitepath.ops.uncopy(self.top, 'my_project', flags)
+        self.assertFalse(flags.snapshot.exists(sp, 'my_project'))
+        self.assertIsNone(flags.snapshot.placed(sp, 'my_project'))
+        sitepath.ops.develop(self.top, 'my_project', flags)
+        self.assertEqual(
+            [r['kind'] for r in flags.snapshot.find(sp, 'my_project')],
+            ['develop'])
+
+        self.do('undevelop my_project')
+        self.do('copy my_project')
+        _write_text(req_file, '\n'.join(['my_project', 'my_file']))
+        self.do('uncopy -n -r ./reqs.txt')
+        self.assertFalse((self.site_packages / 'my_project').exists())
+        self.assertFalse((self.site_packages / 'my_file.py').exists())
+
     def test_link_from_list(self):
         if not self.can_symlink():
             raise unittest.SkipTest('platform disallows symlinks')
@@ -282,6 +1019,146 @@ class TestSitePath(unittest.TestCase):
         self.do('copy my_project')
         self.do('info my_project')
 
+    def test_format(self):
+        import json
+        self.do('copy my_project')
+        self.do('develop my_file.py')
+
+        def run(s):
+            x = io.StringIO()
+            self.top.stdout = x
+            self.do(s)
+            return x.getvalue()
+
+        lines = run('--format ndjson').splitlines()
+        recs = [json.loads(line) for line in lines]
+        self.assertEqual(recs[0]['type'], 'environment')
+        pkgs = {r['name']: r for r in recs if r['type'] == 'package'}
+        self.assertEqual(pkgs['my_project']['kind'], 'copy')
+        self.assertEqual(pkgs['my_project']['origin'], str(self.my_project))
+        self.assertEqual(pkgs['my_file']['kind'], 'develop')
+        self.assertEqual(pkgs['my_file']['status'], 'ok')
+
+        recs = json.loads(run('list copies changed --format json'))
+        self.assertEqual(len(recs), 2)
+        self.assertFalse(recs[1]['changed'])
+
+        recs = json.loads(run('info --format json'))
+        self.assertEqual(sorted(r['kind'] for r in recs), ['copy', 'develop'])
+
+        shutil.rmtree(str(self.my_project))
+        rec = json.loads(run('info my_project --format ndjson'))
+        self.assertEqual(rec['status'], 'missing')
+
+        with self.assertRaises(core.SitePathException):
+            self.do('--format xml')
+
+    def test_watch(self):
+        self.do('copy my_project')
+        self.do('copy my_file.py')
+        dst = self.site_packages / 'my_project'
+
+        # nothing changed, nothing copied
+        self.do('watch --cycles 2 --interval 0 --settle 0')
+
+        _write_text(self.my_project / 'new.py', 'new=1')
+        self.do('watch my_project --cycles 2 --interval 0 --settle 0')
+        self.assertEqual(_read_text(dst / 'new.py'), 'new=1')
+
+        # origin paths name their package, unknown names are refused
+        _write_text(self.my_project / 'new.py', 'new=2')
+        self.do('watch ./my_project %s --cycles 2 --interval 0 --settle 0'
+                % self.my_file)
+        self.assertEqual(_read_text(dst / 'new.py'), 'new=2')
+        for what in ('missing', './missing'):
+            with self.assertRaises(core.SitePathException):
+                self.do('watch %s --cycles 1 --interval 0' % what)
+        c, _ = sitepath.crumb.get_crumb(dst)
+        self.assertNotEqual(c['when'], '1999-12-31T23:59:59.999999')
+
+        # a change that has not settled is not copied yet
+        _write_text(self.my_project / 'new.py', 'new=22')
+        self.do('watch --cycles 2 --interval 0 --settle 60')
+        self.assertEqual(_read_text(dst / 'new.py'), 'new=2')
+
+        # Ctrl-C ends the watch without a traceback
+        import time
+        def interrupt(seconds):
+            raise KeyboardInterrupt
+        sleep, time.sleep = time.sleep, interrupt
+        try:
+            self.do('watch --interval 0')
+        finally:
+            time.sleep = sleep
+        self.assertIn('watch: stopped', self.top.stdout.getvalue())
+
+    def test_timings(self):
+        events = []
+
+        class Observer:
+            def start(self, name, item):
+                events.append(('start', name))
+
+            def end(self, name, item, seconds):
+                events.append(('end', name))
+
+        self.top.observer = Observer()
+        self.top.stderr = io.StringIO()
+        self.do('copy my_project --timings')
+
+        self.assertIn(('start', 'copy'), events)
+        self.assertIn(('end', 'sync'), events)
+        self.assertIn(('end', 'crumb'), events)
+        self.assertEqual(events.count(('start', 'copy')),
+                         events.count(('end', 'copy')))
+
+        report = self.top.stderr.getvalue()
+        self.assertIn('# timings', report)
+        self.assertIn(str(self.my_project), report)
+
+    def _importtime(self, args, check=True):
+        # {module: cumulative microseconds} imported by `-m sitepath`
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=root)
+        proc = subprocess.run(
+            [sys.executable, '-S', '-X', 'importtime', '-m', 'sitepath']
+                + args.split(),
+            cwd=str(self.tmp_dir), env=env, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, universal_newlines=True)
+        if check:
+            self.assertEqual(proc.returncode, 0, proc.stderr)
+        times = {}
+        for line in proc.stderr.splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, name = line.split('|')
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = int(cumulative)
+        return times
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'needs -X importtime')
+    def test_startup_imports(self):
+        heavy = ['sitepath.ops', 'sitepath.copier', 'sitepath.index',
+                 'shutil', 'hashlib', 'filecmp', 'pprint', 'datetime',
+                 'json', 'pathlib', 'concurrent.futures']
+        for args in ('help', 'mvp my_project'):
+            times = self._importtime(args)
+            self.assertIn('sitepath.core', times)
+            for name in heavy:
+                self.assertNotIn(name, times, args)
+            # generous, it also holds without cached bytecode
+            self.assertLess(times['sitepath.core'], 100000, args)
+
+        # the common commands leave out the copy, compile and zip stack
+        stack = ['sitepath.copier', 'sitepath.bytecode', 'sitepath.archive',
+                 'compileall', 'zipfile', 'hashlib', 'concurrent.futures']
+        for args in ('', 'list copies', 'list develops', 'info',
+                     'info my_project', 'uncopy my_project'):
+            # nothing is installed, the last two only look
+            times = self._importtime(args, check=False)
+            self.assertIn('sitepath.core', times)
+            for name in stack:
+                self.assertNotIn(name, times, args)
+
     def test_mvp(self):
         self.do('mvp my_project')
 
@@ -301,13 +1178,68 @@ class TestSitePath(unittest.TestCase):
 
         _write_text(spf, '1234')
 
+        # the installed copy is only looked at with --deep
         x = io.StringIO()
         self.top.stdout = x
         self.do('list changed')
+        self.assertFalse(str(self.my_file) in x.getvalue())
+
+        x = io.StringIO()
+        self.top.stdout = x
+        self.do('list changed --deep')
 
         v = x.getvalue()
         self.assertTrue(str(self.my_file) in v)
 
+    def test_compare_manifest(self):
+        sub = self.my_project / 'sub'
+        sub.mkdir()
+        _write_text(sub / 'a.py', 'a=1')
+        self.do('copy my_project')
+
+        dst = self.site_packages / 'my_project'
+        manifest = sitepath.crumb.get_manifest(dst)
+        self.assertEqual(sorted(manifest['files']),
+                         ['__init__.py', os.path.join('sub', 'a.py')])
+
+        def changed(s=''):
+            x = io.StringIO()
+            self.top.stdout = x
+            self.do('list changed' + s)
+            return str(self.my_project) in x.getvalue()
+
+        self.assertFalse(changed())
+        self.assertFalse(changed(' --deep'))
+
+        # a change in a subdirectory of the origin
+        _write_text(sub / 'a.py', 'a=2')
+        self.assertTrue(changed())
+        self.assertTrue(changed(' --deep'))
+
+        self.do('copy my_project')
+        self.assertFalse(changed())
+
+        self.do('uncopy my_project')
+        self.assertIsNone(sitepath.crumb.get_manifest(dst))
+
+    def test_compare_parallel(self):
+        self.do('copy my_project')
+        self.do('copy my_file.py')
+        _write_text(self.my_file, 'file=False')
+
+        x = io.StringIO()
+        self.top.stdout = x
+        self.top.stderr = io.StringIO()
+        self.do('list changed -j 4')
+
+        v = x.getvalue().splitlines()
+        self.assertEqual(v, ['# sitepath-copied and different',
+                             str(self.my_file)])
+        self.assertEqual(self.top.stderr.getvalue(), '')
+
+        self.do('--timings list changed -j 4 --unordered')
+        self.assertIn('compare', self.top.stderr.getvalue())
+
     # -- Test error conditions, invalid input, etc
 
     def test_link_copy(self):